@@ -6,7 +6,35 @@ assert PY35, "Require python 3.5 or later version"
 from .error import *
 from .api import *
 from .stream_api import *
+from .transport import *
+from .candle_cache import *
+from .cache import *
+from .rate_limit import *
+from .token_manager import *
+from .stream_manager import *
+from .shm_ring import *
+from .instrumentation import *
+from .serializer import *
+from .account_state import *
+from .deals import *
+from .bulk import *
+from .candles import *
+from .converters import *
 
-__all__ = [error.__all__ +
-           api.__all__ +
-           stream_api.__all__]
+__all__ = (error.__all__ +
+            api.__all__ +
+            stream_api.__all__ +
+            transport.__all__ +
+            candle_cache.__all__ +
+            cache.__all__ +
+            rate_limit.__all__ +
+            token_manager.__all__ +
+            stream_manager.__all__ +
+            shm_ring.__all__ +
+            instrumentation.__all__ +
+            serializer.__all__ +
+            account_state.__all__ +
+            deals.__all__ +
+            bulk.__all__ +
+            candles.__all__ +
+            converters.__all__)
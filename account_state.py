@@ -0,0 +1,286 @@
+import asyncio
+from collections import OrderedDict
+from .log import logger
+
+
+__all__ = ['AccountState']
+
+
+TRADE_FIELDS = ['CONFIRMS', 'OPU', 'WOU']
+RESYNC_INTERVAL = 300
+CONFIRMS_SIZE = 1000
+DELETED = "DELETED"
+REJECTED = "REJECTED"
+SIGNS = {"BUY": 1, "SELL": -1}
+
+
+def _position(entry):
+    return dict(entry["position"], epic=entry["market"]["epic"])
+
+
+def _order(entry):
+    order = dict(entry["workingOrderData"])
+    order.setdefault("epic", entry["marketData"]["epic"])
+    if "orderSize" in order:
+        order["size"] = order.pop("orderSize")
+    if "orderLevel" in order:
+        order["level"] = order.pop("orderLevel")
+    return order
+
+
+def _key(deal, level=False):
+    size = deal.get("size")
+    key = (deal.get("epic"), deal.get("direction"), None if size is None else float(size))
+    if level:
+        key += (deal.get("level"),)
+    return key
+
+
+class AccountState:
+    """Positions and working orders of one account, kept in memory.
+
+    - Seeded from get_all_positions/get_all_workingorders, then updated by
+      OPU/WOU of the TRADE:<accountId> table on `stream`
+    - Updates arriving while a snapshot is fetched are replayed on top of it
+    - Every `resync_interval` seconds the state is compared to a REST
+      snapshot (epic, direction, size and order level) and replaced on drift,
+      a round is skipped when stream updates arrived meanwhile
+    - Positions and orders are flat dicts keyed by dealId, with epic, size
+      and level also for orders; CONFIRMS keep the last CONFIRMS_SIZE by
+      dealReference, wait_confirm() resolves on them without waiting for a
+      running resync
+    - Call resync() after the stream reconnects, updates sent in between are
+      lost
+    """
+
+    def __init__(self, web_api, stream, account_id=None, resync_interval=RESYNC_INTERVAL):
+        self._web_api = web_api
+        self._stream = stream
+        self._account_id = account_id
+        self._resync_interval = resync_interval
+        self._sub_id = None
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._buffer = None
+        self._version = 0
+        self._last = {}
+        self.positions = {}
+        self.orders = {}
+        self._position_epics = {}
+        self._order_epics = {}
+        self.confirms = OrderedDict()
+        self._waiters = {}
+        self.stats = {"updates": 0, "checks": 0, "skipped": 0, "drifts": 0, "resyncs": 0}
+
+    @property
+    def account_id(self):
+        return self._account_id
+
+    def position(self, deal_id):
+        return self.positions.get(deal_id)
+
+    def order(self, deal_id):
+        return self.orders.get(deal_id)
+
+    def confirm(self, deal_reference):
+        return self.confirms.get(deal_reference)
+
+    @property
+    def streaming(self):
+        return self._sub_id is not None and self._stream.connected
+
+    def wait_confirm(self, deal_reference):
+        """Future of the CONFIRMS update of deal_reference, cancel it to
+        stop waiting.
+        """
+        waiter = asyncio.Future()
+        confirm = self.confirms.get(deal_reference)
+        if confirm is not None:
+            waiter.set_result(confirm)
+            return waiter
+        waiters = self._waiters.setdefault(deal_reference, [])
+        waiters.append(waiter)
+        waiter.add_done_callback(lambda _: self._discard_waiter(deal_reference, waiter))
+        return waiter
+
+    def _discard_waiter(self, deal_reference, waiter):
+        waiters = self._waiters.get(deal_reference)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[deal_reference]
+
+    def positions_for(self, epic):
+        return [self.positions[deal_id] for deal_id in self._position_epics.get(epic, ())]
+
+    def orders_for(self, epic):
+        return [self.orders[deal_id] for deal_id in self._order_epics.get(epic, ())]
+
+    def exposure(self, epic, orders=False):
+        """Signed size of the open positions on epic, BUY positive, with
+        orders=True working orders count as filled.
+        """
+        deals = self.positions_for(epic)
+        if orders:
+            deals += self.orders_for(epic)
+        return sum(SIGNS.get(deal.get("direction"), 0) * float(deal.get("size") or 0)
+                   for deal in deals)
+
+    def exposures(self, orders=False):
+        epics = set(self._position_epics)
+        if orders:
+            epics.update(self._order_epics)
+        return dict([(epic, self.exposure(epic, orders)) for epic in epics])
+
+    async def start(self):
+        if self._account_id is None:
+            detail = await self._web_api.api('session_detail')
+            self._account_id = detail['accountId']
+        conf = {'mode': 'DISTINCT', 'items': ['TRADE:' + self._account_id], 'fields': TRADE_FIELDS}
+        self._sub_id = self._stream.subscribe(conf, self._on_update)
+        await self.resync()
+        if self._resync_interval and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._sub_id is not None:
+            self._stream.unsubscribe(self._sub_id)
+            self._sub_id = None
+
+    async def resync(self):
+        """Replace the state by a REST snapshot.
+        """
+        async with self._lock:
+            self._buffer = []
+            try:
+                positions, orders = await self._snapshot()
+            except Exception:
+                self._replay()
+                raise
+            self._replace(positions, orders)
+            self._replay()
+            self.stats["resyncs"] += 1
+
+    async def check(self):
+        """Compare with a REST snapshot, resync on drift, return the dealIds
+        that differed or None when the round was skipped.
+        """
+        async with self._lock:
+            version = self._version
+            positions, orders = await self._snapshot()
+            self.stats["checks"] += 1
+            if version != self._version:
+                self.stats["skipped"] += 1
+                return None
+            drift = self._diff(self.positions, positions) + self._diff(self.orders, orders, True)
+            if drift:
+                logger.warning("Account state drift on %d deals: %s", len(drift), drift)
+                self.stats["drifts"] += 1
+                self._replace(positions, orders)
+            return drift
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._resync_interval)
+            try:
+                await self.check()
+            except Exception as exc:
+                logger.error("Account state check fail: %r", exc)
+
+    async def _snapshot(self):
+        positions, orders = await asyncio.gather(self._web_api.api('get_all_positions'),
+                                                 self._web_api.api('get_all_workingorders'))
+        positions = [_position(entry) for entry in positions["positions"]]
+        orders = [_order(entry) for entry in orders["workingOrders"]]
+        return (dict([(deal["dealId"], deal) for deal in positions]),
+                dict([(deal["dealId"], deal) for deal in orders]))
+
+    def _diff(self, deals, snapshot, level=False):
+        return sorted(deal_id for deal_id in set(deals) | set(snapshot)
+                      if deal_id not in deals or deal_id not in snapshot or
+                      _key(deals[deal_id], level) != _key(snapshot[deal_id], level))
+
+    def _replace(self, positions, orders):
+        self.positions = {}
+        self.orders = {}
+        self._position_epics = {}
+        self._order_epics = {}
+        for deal in positions.values():
+            self._put(self.positions, self._position_epics, deal)
+        for deal in orders.values():
+            self._put(self.orders, self._order_epics, deal)
+
+    def _replay(self):
+        buffer, self._buffer = self._buffer, None
+        for values in buffer:
+            self._apply(values)
+
+    def _put(self, deals, epics, deal):
+        deal_id = deal["dealId"]
+        old = deals.get(deal_id)
+        if old is not None and old.get("epic") != deal.get("epic"):
+            self._remove(deals, epics, deal_id)
+        deals[deal_id] = deal
+        epics.setdefault(deal.get("epic"), set()).add(deal_id)
+
+    def _remove(self, deals, epics, deal_id):
+        old = deals.pop(deal_id, None)
+        if old is None:
+            return
+        ids = epics.get(old.get("epic"))
+        ids.discard(deal_id)
+        if not ids:
+            del epics[old.get("epic")]
+
+    async def _on_update(self, info):
+        values = info["values"]
+        updates = {}
+        for field in TRADE_FIELDS:
+            raw = values.get(field)
+            # DISTINCT updates carry unchanged fields forward
+            if not raw or raw == self._last.get(field):
+                continue
+            self._last[field] = raw
+            try:
+                updates[field] = self._web_api.serializer.loads(raw.encode('utf-8'))
+            except ValueError:
+                logger.warning("Bad %s update: %s", field, raw)
+        if not updates:
+            return
+        confirm = updates.get("CONFIRMS")
+        if confirm is not None:
+            self._confirmed(confirm)
+        self._version += 1
+        self.stats["updates"] += 1
+        if self._buffer is not None:
+            self._buffer.append(updates)
+        else:
+            self._apply(updates)
+
+    def _confirmed(self, confirm):
+        deal_reference = confirm.get("dealReference")
+        self.confirms[deal_reference] = confirm
+        if len(self.confirms) > CONFIRMS_SIZE:
+            self.confirms.popitem(last=False)
+        for waiter in list(self._waiters.get(deal_reference, ())):
+            if not waiter.done():
+                waiter.set_result(confirm)
+
+    def _apply(self, updates):
+        position = updates.get("OPU")
+        if position is not None:
+            self._apply_deal(self.positions, self._position_epics, position)
+        order = updates.get("WOU")
+        if order is not None:
+            self._apply_deal(self.orders, self._order_epics, order)
+
+    def _apply_deal(self, deals, epics, deal):
+        if deal.get("dealId") is None or deal.get("dealStatus") == REJECTED:
+            return
+        if deal.get("status") == DELETED:
+            self._remove(deals, epics, deal["dealId"])
+        else:
+            self._put(deals, epics, deal)
@@ -1,20 +1,49 @@
-import json
+import time
 import aiohttp
 import asyncio
 from .log import logger
 from .error import *
+from .prices import PricePager
+from .endpoints import ENDPOINTS
+from .serializer import get_serializer
+from .token_manager import TokenManager, TOKEN_TTL
 
 
 __all__ = ['IGWebAPI']
 
 
+MARKET_DETAIL_CHUNK = 50
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30
+RETRIES = 5
+FANOUT_APIS = frozenset(['market_detail_mul'])
+NOT_FOUND_APIS = frozenset(['confirm_deal', 'close_positions', 'update_positions',
+                            'delete_workingorders', 'update_workingorders', 'get_positions'])
+
+
 class IGWebAPI:
     """Implement web API of IG.
 
     - Auto re-login
+    - Pass a Transport to share its connection pool
+    - Pass a ResponseCache to cache read-only endpoints
+    - Pass a RateLimiter to schedule requests under IG's limits
+    - Error responses are retried up to `retries` times, backing off from
+      BACKOFF_MIN doubling up to BACKOFF_MAX seconds (a 401 re-logins
+      instead), then raised. A 404 of NOT_FOUND_APIS raises NotFoundError
+    - Tokens renewed ahead of expiry, one login shared by concurrent
+      callers, see TokenManager. With refresh_tokens (default) a background
+      task renews them from the first log_in() until close(), otherwise
+      only on the next request
+    - Pass an Instrumentation to get request phase timings and per-call
+      retry/relogin counts
+    - JSON goes through stdlib json, json_backend picks another of
+      serializer.BACKENDS (orjson, ujson)
     """
 
-    def __init__(self, api_prefix, app_key, account, password, **kwargs):
+    def __init__(self, api_prefix, app_key, account, password, transport=None, cache=None,
+                 limiter=None, token_ttl=TOKEN_TTL, instrument=None, json_backend=None,
+                 retries=RETRIES, refresh_tokens=True, **kwargs):
         self._api_prefix = api_prefix
         self._app_key = app_key
         self._account = account
@@ -24,16 +53,67 @@ class IGWebAPI:
             "Accept": "application/json; charset=UTF-8",
             "X-IG-API-KEY": self._app_key,
         }
-        self._session = aiohttp.ClientSession(headers=self._headers, raise_for_status=True, **kwargs)
+        self._cache = cache
+        self._limiter = limiter
+        self._retries = retries
+        self._refresh_tokens = refresh_tokens
+        self._tokens = TokenManager(self._log_in_retry, ttl=token_ttl)
+        self._instrument = instrument
+        self._serializer = get_serializer(json_backend)
+        if instrument is not None and instrument.trace_configs():
+            kwargs = dict(kwargs, trace_configs=instrument.trace_configs())
+        if transport is None:
+            self._session = aiohttp.ClientSession(headers=self._headers, raise_for_status=True, **kwargs)
+        else:
+            self._session = transport.session(headers=self._headers, raise_for_status=True, **kwargs)
+        self._version_headers = {}
+        self._rebuild_headers()
+        self._funcs = dict([
+            (ep.name, ep.compile(self._api_prefix, self._session.request, self._version_headers,
+                                 instrument, self._serializer))
+            for ep in ENDPOINTS
+        ])
+        self._funcs['log_in'] = self._log_in
+        self._funcs['market_detail_mul'] = self._market_detail_mul
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def limiter(self):
+        return self._limiter
+
+    @property
+    def serializer(self):
+        return self._serializer
+
+    @property
+    def instrument(self):
+        return self._instrument
+
+    @property
+    def tokens(self):
+        return self._tokens
 
     def set_headers(self, headers):
         self._headers.update(headers)
+        self._rebuild_headers()
+
+    def _rebuild_headers(self):
+        for v in set([ep.version for ep in ENDPOINTS]):
+            self._version_headers[v] = dict(self._headers, Version=v)
 
     @property
     def headers(self):
         return self._headers
 
     async def log_in(self):
+        await self._tokens.renew()
+        if self._refresh_tokens:
+            self._tokens.start()
+
+    async def _log_in_retry(self):
         t = 3
         while t>0:
             try:
@@ -48,13 +128,42 @@ class IGWebAPI:
             raise LoginRetryError()
 
     async def api(self, api_name, *args, **kwargs):
-        func_name = '_' + api_name
-        try:
-            func = getattr(self, func_name)
-        except AttributeError:
+        func = self._funcs.get(api_name)
+        if func is None:
             raise UnkownAPIError(api_name)
 
+        call = self._call if self._instrument is None else self._timed_call
+        if self._cache is not None:
+            return await self._cache.call(api_name, args, kwargs,
+                                          lambda: call(api_name, func, *args, **kwargs))
+        return await call(api_name, func, *args, **kwargs)
+
+    async def _timed_call(self, api_name, func, *args, **kwargs):
+        stats = {"queued": 0.0, "retries": 0, "relogins": 0, "relogin": 0.0}
+        started = time.perf_counter()
+        error = None
+        try:
+            return await self._call(api_name, func, *args, _stats=stats, **kwargs)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._instrument.call(api_name, time.perf_counter() - started, stats["queued"],
+                                  stats["retries"], stats["relogins"], stats["relogin"], error)
+
+    async def _call(self, api_name, func, *args, _stats=None, **kwargs):
+        backoff = BACKOFF_MIN
+        retries = 0
+        limited = self._limiter is not None and api_name not in FANOUT_APIS
+        tokens = self._tokens
         while True:
+            if tokens.due():
+                await self._renew(_stats, tokens.generation)
+            if limited:
+                queued = await self._limiter.acquire(api_name)
+                if _stats is not None:
+                    _stats["queued"] += queued
+            generation = tokens.generation
             try:
                 result = await func(*args, **kwargs)
             except asyncio.TimeoutError as exc:
@@ -62,15 +171,41 @@ class IGWebAPI:
             except aiohttp.ServerTimeoutError as exc:
                 raise APITimeoutError('Connect timeout')
             except aiohttp.ClientResponseError as exc:
-                logger.error("Code[%s] %s" % (exc.code, exc.message))
-                if exc.code == 401:
+                if exc.status == 404 and api_name in NOT_FOUND_APIS:
+                    raise NotFoundError(api_name)
+                logger.error("Code[%s] %s", exc.status, exc.message)
+                retries += 1
+                if retries > self._retries:
+                    raise
+                if _stats is not None:
+                    _stats["retries"] += 1
+                if exc.status == 401:
                     logger.info("Relogin")
-                    await self.log_in()
+                    await self._renew(_stats, generation)
+                else:
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff*2, BACKOFF_MAX)
             else:
                 return result
 
-    def __del__(self):
-        self._session.close()
+    async def _renew(self, stats, generation):
+        if stats is None:
+            return await self._tokens.renew(generation)
+        started = time.perf_counter()
+        await self._tokens.renew(generation)
+        stats["relogins"] += 1
+        stats["relogin"] += time.perf_counter() - started
+
+    def iter_prices(self, epic, resolution, start_date='', end_date='', page_size=20,
+                    columnar=False, prefetch=True):
+        """Async iterator over all pages of `prices`, see PricePager.
+        """
+        return PricePager(self, epic, resolution, start_date, end_date, page_size,
+                          columnar=columnar, prefetch=prefetch)
+
+    async def close(self):
+        await self._tokens.stop()
+        await self._session.close()
 
     async def _log_in(self):
         api = "/session"
@@ -83,383 +218,30 @@ class IGWebAPI:
             "identifier": self._account,
             "password": self._password,
         }
-        async with self._session.post(self._api_prefix+api, headers=headers, json=data) as resp:
-            await resp.json()
+        async with self._session.post(self._api_prefix+api, headers=headers,
+                                      data=self._serializer.dumps(data)) as resp:
+            self._serializer.loads(await resp.read())
             self._headers['CST'] = resp.headers.get('CST')
             self._headers['X-SECURITY-TOKEN'] = resp.headers.get('X-SECURITY-TOKEN')
-
-    async def _session_detail(self):
-        api = "/session"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _log_out(self):
-        api = "/session"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.delete(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _get_encryption_key(self):
-        api = "/session/encryptionKey"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _refresh_token(self, refresh_token):
-        api = "/session/refresh-token"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        data = {
-            "refresh_token": name
-        }
-        async with self._session.post(self._api_prefix+api, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _accounts(self):
-        api = "/accounts"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _market_navigation(self, node_id=''):
-        api = "/marketnavigation"
-        headers = self._headers.copy()
-        if node_id:
-            api += '/'+node_id
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _market_detail(self, epic):
-        api = "/markets"
-        headers = self._headers.copy()
-        api += '/' + epic
-        headers["Version"] = "3"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _market_detail_mul(self, epics, filter='ALL'):
-        api = "/markets"
-        headers = self._headers.copy()
-        params = {}
-        headers["Version"] = "2"
-        params['epics'] = ','.join(epics[:50])
-        params['filter'] = filter
-        async with self._session.get(self._api_prefix+api, headers=headers, params=params) as resp:
-            info = await resp.json()
-            return info
-
-    async def _market_search(self, searchTerm=''):
-        api = "/markets"
-        headers = self._headers.copy()
-        params = {}
-        headers["Version"] = "1"
-        params['searchTerm'] = searchTerm
-        async with self._session.get(self._api_prefix+api, headers=headers, params=params) as resp:
-            info = await resp.json()
-            return info
-
-    async def _prices(self, epic, resolution, start_date='', end_date='', max=10, page_size=20, page_num=1):
-        api = "/prices"
-        api += '/' + epic
-        headers = self._headers.copy()
-        headers["Version"] = "3"
-        params = {}
-        assert resolution in ["SECOND", "MINUTE", "MINUTE_2", "MINUTE_3", "MINUTE_5",
-                                "MINUTE_10", "MINUTE_15", "MINUTE_30", "HOUR", "HOUR_2",
-                                "HOUR_3", "HOUR_4", "DAY", "WEEK", "MONTH"], "resolution is illegal"
-        params['resolution'] = resolution
-        if start_date:
-            params['from'] = start_date
-        if end_date:
-            params['to'] = end_date
-        params['max'] = max
-        params['pageSize'] = page_size
-        params['pageNumber'] = page_num
-        async with self._session.get(self._api_prefix+api, headers=headers, params=params) as resp:
-            info = await resp.json()
-            return info
-
-    async def _all_watchlist(self):
-        api = "/watchlists"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _create_watchlist(self, name, epics):
-        api = "/watchlists"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        data = {
-            "name": name,
-            "epics": epics,
-        }
-        async with self._session.post(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _delete_watchlist(self, watchlist_id):
-        api = "/watchlists"
-        api += '/' + watchlist_id
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.delete(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _watchlist_detail(self, watchlist_id):
-        api = "/watchlists"
-        api += '/' + watchlist_id
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _add_market_to_watchlist(self, watchlist_id, epic):
-        api = "/watchlists"
-        api += '/' + watchlist_id
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        data = {
-            "epic": epic
-        }
-        async with self._session.put(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _remove_market_from_watchlist(self, watchlist_id, epic):
-        api = "/watchlists"
-        api += '/' + watchlist_id + '/' + epic
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.delete(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _client_sentiment_mul(self, marketids):
-        api = "/clientsentiment"
-        headers = self._headers.copy()
-        params = {}
-        headers["Version"] = "1"
-        params['marketIds'] = ','.join(marketids)
-        async with self._session.get(self._api_prefix+api, headers=headers, params=params) as resp:
-            info = await resp.json()
-            return info
-
-    async def _client_sentiment(self, marketid):
-        api = "/clientsentiment"
-        api += '/' + marketid
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _related_client_sentiment(self, marketid):
-        api = "/clientsentiment/related"
-        api += '/' + marketid
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _history_activity(self, start_date='', end_date='', detailed=False, dealid='', page_size=50, filter=''):
-        api = "/history/activity"
-        headers = self._headers.copy()
-        headers["Version"] = "3"
-        params = {}
-        params['from'] = start_date
-        params['to'] = end_date
-        params['detailed'] = detailed
-        params['dealId'] = dealid
-        params['filter'] = filter
-        params['pageSize'] = page_size
-        async with self._session.get(self._api_prefix+api, headers=headers, params=params) as resp:
-            info = await resp.json()
-            return info
-
-    async def _confirm_deal(self, deal_reference):
-        api = "/confirms"
-        api += '/' + deal_reference
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _get_positions(self, dealid):
-        api = "/positions"
-        api += '/' + dealid
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _get_all_positions(self):
-        api = "/positions"
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _open_positions(self, deal_reference, currency, direction, epic, expiry,
-                              force_open, guaranteed_stop, level, size, order_type,
-                              limit_distance, limit_level, stop_distance, stop_level,
-                              time_in_force, trailing_stop, trailing_stop_increment):
-        api = "/positions/otc"
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        assert direction in ["BUY", "SELL"], "direction error @open_positions"
-        assert order_type in ["LIMIT", "MARKET"], "order_type error @open_positions"
-        assert time_in_force in ["EXECUTE_AND_ELIMINATE", "FILL_OR_KILL"], "time_in_force error @open_positions"
-        data = {
-            'currencyCode': currency,
-            'dealReference': deal_reference,
-            'direction': direction,
-            'epic': epic,
-            'expiry': expiry,
-            'forceOpen': force_open,
-            'guaranteedStop': guaranteed_stop,
-            'level': level,
-            'size': size,
-            'orderType': order_type,
-            'limitDistance': limit_distance,
-            'limitLevel': limit_level,
-            'stopDistance': stop_distance,
-            'stopLevel': stop_level,
-            'timeInForce': time_in_force,
-            'trailingStop': trailing_stop,
-            'trailingStopIncrement': trailing_stop_increment,
-        }
-        async with self._session.post(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _close_positions(self, dealid, direction, epic, expiry, level, size,
-                               order_type, time_in_force):
-        api = "/positions/otc"
-        headers = self._headers.copy()
-        headers["Version"] = "1"
-        assert direction in ["BUY", "SELL"], "direction error @open_position"
-        assert order_type in ["LIMIT", "MARKET"], "order_type error @open_position"
-        assert time_in_force in ["EXECUTE_AND_ELIMINATE", "FILL_OR_KILL"], "time_in_force error @open_position"
-        data = {
-            'dealId': dealid,
-            'direction': direction,
-            'epic': epic,
-            'expiry': expiry,
-            'level': level,
-            'size': size,
-            'orderType': order_type,
-            'timeInForce': time_in_force
-        }
-        async with self._session.delete(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _update_positions(self, dealid, limit_level, stop_level, trailing_stop,
-                                trailing_stop_distance, trailing_stop_increment):
-        api = "/positions/otc"
-        api += '/' + dealid
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        data = {
-            'limitLevel': limit_level,
-            'stopLevel': stop_level,
-            'trailingStop': trailing_stop,
-            'trailingStopDistance': trailing_stop_distance,
-            'trailingStopIncrement': trailing_stop_increment,
-        }
-        async with self._session.put(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _get_all_workingorders(self):
-        api = "/workingorders"
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _create_workingorders(self, deal_reference, currency, direction, epic, expiry,
-                                   force_open, guaranteed_stop, level, size, order_type,
-                                   limit_distance, limit_level, stop_distance, stop_level,
-                                   time_in_force, good_till_date):
-        api = "/workingorders/otc"
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        assert direction in ["BUY", "SELL"], "direction error @create_workingorders"
-        assert order_type in ["LIMIT", "STOP"], "order_type error @create_workingorders"
-        assert time_in_force in ["GOOD_TILL_CANCELLED", "GOOD_TILL_DATE"], "time_in_force error @create_workingorders"
-        data = {
-            'currencyCode': currency,
-            'dealReference': deal_reference,
-            'direction': direction,
-            'epic': epic,
-            'expiry': expiry,
-            'forceOpen': force_open,
-            'guaranteedStop': guaranteed_stop,
-            'level': level,
-            'size': size,
-            'type': order_type,
-            'limitDistance': limit_distance,
-            'limitLevel': limit_level,
-            'stopDistance': stop_distance,
-            'stopLevel': stop_level,
-            'timeInForce': time_in_force,
-            'goodTillDate': good_till_date,
-        }
-        async with self._session.post(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
-
-    async def _delete_workingorders(self, dealid):
-        api = "/workingorders/otc"
-        api += '/' + dealid
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        async with self._session.delete(self._api_prefix+api, headers=headers) as resp:
-            info = await resp.json()
-            return info
-
-    async def _update_workingorders(self, dealid, level, order_type, limit_distance,
-                                    limit_level, stop_distance, stop_level, time_in_force,
-                                    good_till_date):
-        api = "/workingorders/otc"
-        api += '/' + dealid
-        headers = self._headers.copy()
-        headers["Version"] = "2"
-        assert order_type in ["LIMIT", "STOP"], "order_type error @update_workingorders"
-        assert time_in_force in ["GOOD_TILL_CANCELLED", "GOOD_TILL_DATE"], "time_in_force error @update_workingorders"
-        data = {
-            'level': level,
-            'type': order_type,
-            'limitDistance': limit_distance,
-            'limitLevel': limit_level,
-            'stopDistance': stop_distance,
-            'stopLevel': stop_level,
-            'timeInForce': time_in_force,
-            'goodTillDate': good_till_date,
-        }
-        async with self._session.put(self._api_prefix+api, headers=headers, json=data) as resp:
-            info = await resp.json()
-            return info
+            self._rebuild_headers()
+
+    async def _market_detail_mul(self, epics, filter='ALL', concurrency=4):
+        """Request epics in chunks of MARKET_DETAIL_CHUNK, at most `concurrency`
+        chunks in flight. Failed chunks are listed in "errors".
+        """
+        chunks = [epics[i:i+MARKET_DETAIL_CHUNK] for i in range(0, len(epics), MARKET_DETAIL_CHUNK)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(chunk):
+            async with semaphore:
+                return await self.api('market_detail_chunk', chunk, filter)
+
+        results = await asyncio.gather(*[fetch(chunk) for chunk in chunks], return_exceptions=True)
+        info = {"marketDetails": [], "errors": []}
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                logger.error("market_detail_mul chunk fail: %r", result)
+                info["errors"].append({"epics": chunk, "error": result})
+            else:
+                info["marketDetails"].extend(result.get("marketDetails", []))
+        return info
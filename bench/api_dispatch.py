@@ -0,0 +1,149 @@
+"""Per-call overhead of IGWebAPI.api against a no-op session.
+
+    python -m qig.bench.api_dispatch [--calls N] [--json-backend NAME]
+
+Compares the endpoint table with the previous getattr dispatch and
+per-method header copies. The table decodes with --json-backend (default
+json, like the legacy methods).
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from ..api import IGWebAPI
+from ..serializer import BACKENDS
+
+
+BODY = b'{"dealReference": "REF"}'
+dumps = json.dumps
+
+
+class NullResponse:
+    headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def json(self):
+        return json.loads(BODY.decode('utf-8'))
+
+    async def read(self):
+        return BODY
+
+
+class NullSession:
+    """Encodes `json` bodies like aiohttp, responses carry BODY."""
+
+    def request(self, method, url, json=None, **kwargs):
+        if json is not None:
+            dumps(json)
+        return NullResponse()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        pass
+
+
+class NullTransport:
+    def session(self, **kwargs):
+        return NullSession()
+
+
+class LegacyAPI(IGWebAPI):
+    """IGWebAPI with the getattr dispatch and per-method header copies it
+    used before the endpoint table."""
+
+    async def api(self, api_name, *args, **kwargs):
+        func_name = '_' + api_name
+        try:
+            func = getattr(self, func_name)
+        except AttributeError:
+            raise RuntimeError(api_name)
+        return await self._call(api_name, func, *args, **kwargs)
+
+    async def _market_detail(self, epic):
+        api = "/markets"
+        headers = self._headers.copy()
+        api += '/' + epic
+        headers["Version"] = "3"
+        async with self._session.get(self._api_prefix+api, headers=headers) as resp:
+            info = await resp.json()
+            return info
+
+    async def _open_positions(self, deal_reference, currency, direction, epic, expiry,
+                              force_open, guaranteed_stop, level, size, order_type,
+                              limit_distance, limit_level, stop_distance, stop_level,
+                              time_in_force, trailing_stop, trailing_stop_increment):
+        api = "/positions/otc"
+        headers = self._headers.copy()
+        headers["Version"] = "2"
+        assert direction in ["BUY", "SELL"], "direction error @open_positions"
+        assert order_type in ["LIMIT", "MARKET"], "order_type error @open_positions"
+        assert time_in_force in ["EXECUTE_AND_ELIMINATE", "FILL_OR_KILL"], "time_in_force error @open_positions"
+        data = {
+            'currencyCode': currency,
+            'dealReference': deal_reference,
+            'direction': direction,
+            'epic': epic,
+            'expiry': expiry,
+            'forceOpen': force_open,
+            'guaranteedStop': guaranteed_stop,
+            'level': level,
+            'size': size,
+            'orderType': order_type,
+            'limitDistance': limit_distance,
+            'limitLevel': limit_level,
+            'stopDistance': stop_distance,
+            'stopLevel': stop_level,
+            'timeInForce': time_in_force,
+            'trailingStop': trailing_stop,
+            'trailingStopIncrement': trailing_stop_increment,
+        }
+        async with self._session.post(self._api_prefix+api, headers=headers, json=data) as resp:
+            info = await resp.json()
+            return info
+
+
+CALLS = [
+    ('market_detail', ('CS.D.EURUSD.MINI.IP',)),
+    ('open_positions', ('REF', 'USD', 'BUY', 'CS.D.EURUSD.MINI.IP', '-', True, False, None, 1,
+                        'MARKET', None, None, None, None, 'FILL_OR_KILL', False, None)),
+]
+
+
+async def measure(api, api_name, args, calls):
+    t = time.perf_counter()
+    for _ in range(calls):
+        await api.api(api_name, *args)
+    return (time.perf_counter() - t) / calls * 1e6
+
+
+async def run(calls, json_backend):
+    legacy = LegacyAPI("https://demo-api.ig.com/gateway/deal", "KEY", "", "", transport=NullTransport())
+    current = IGWebAPI("https://demo-api.ig.com/gateway/deal", "KEY", "", "", transport=NullTransport(),
+                       json_backend=json_backend)
+    for api_name, args in CALLS:
+        before = await measure(legacy, api_name, args, calls)
+        after = await measure(current, api_name, args, calls)
+        print("%-16s legacy %7.2f us  table %7.2f us  %5.2fx" % (api_name, before, after, before / after))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--json-backend', default='json', choices=BACKENDS)
+    args = parser.parse_args(argv)
+    asyncio.get_event_loop().run_until_complete(run(args.calls, args.json_backend))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
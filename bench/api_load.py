@@ -0,0 +1,131 @@
+"""Drive concurrent IGWebAPI.api() calls against a local FakeGateway.
+
+    python -m qig.bench.api_load [--calls N] [--concurrency C] [--latency S]
+                                 [--error-rate P] [--timeout-rate P] [--token-ttl S]
+                                 [--expire-every S] [--verbose]
+
+Reports throughput, latency percentiles, logins seen by the client and the
+gateway, 401s, errors and how many connections the client opened.
+"""
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+from ..api import IGWebAPI
+from ..log import logger
+from ..error import APITimeoutError
+from ..transport import Transport
+from .fake_gateway import FakeGateway
+
+
+EPICS = ['CS.D.EURUSD.CFD.IP', 'CS.D.GBPUSD.CFD.IP', 'CS.D.USDJPY.CFD.IP',
+         'IX.D.FTSE.DAILY.IP', 'IX.D.DAX.DAILY.IP', 'CC.D.LCO.USS.IP']
+
+
+def workload(rnd):
+    r = rnd.random()
+    epic = rnd.choice(EPICS)
+    if r < 0.4:
+        return 'market_detail', (epic,)
+    elif r < 0.6:
+        return 'prices', (epic, 'MINUTE', '', '', 10)
+    elif r < 0.75:
+        return 'market_detail_chunk', (EPICS,)
+    elif r < 0.85:
+        return 'market_search', ('eur',)
+    elif r < 0.95:
+        return 'get_all_positions', ()
+    return 'all_watchlist', ()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def expire_every(gateway, period):
+    while True:
+        await asyncio.sleep(period)
+        gateway.expire_tokens()
+
+
+async def run(args):
+    gateway = FakeGateway(latency=args.latency, jitter=args.latency, error_rate=args.error_rate,
+                          timeout_rate=args.timeout_rate, hang=args.read_timeout * 2,
+                          token_ttl=args.token_ttl)
+    await gateway.start()
+    transport = Transport(limit=args.concurrency, limit_per_host=args.concurrency)
+    web_api = IGWebAPI(gateway.url, 'key', 'account', 'password', transport=transport,
+                       read_timeout=args.read_timeout, conn_timeout=5)
+    await web_api.log_in()
+
+    rnd = random.Random(1)
+    calls = [workload(rnd) for _ in range(args.calls)]
+    latencies = []
+    failures = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(api_name, call_args):
+        async with semaphore:
+            t = time.perf_counter()
+            try:
+                await web_api.api(api_name, *call_args)
+            except APITimeoutError as exc:
+                failures["timeout"] = failures.get("timeout", 0) + 1
+                return
+            except Exception as exc:
+                name = type(exc).__name__
+                failures[name] = failures.get(name, 0) + 1
+                return
+            latencies.append(time.perf_counter() - t)
+
+    expiring = None
+    if args.expire_every:
+        expiring = asyncio.ensure_future(expire_every(gateway, args.expire_every))
+    logins = web_api.tokens.logins
+    started = time.perf_counter()
+    await asyncio.gather(*[call(api_name, call_args) for api_name, call_args in calls])
+    elapsed = time.perf_counter() - started
+    if expiring is not None:
+        expiring.cancel()
+    await gateway.stop()
+    await web_api.close()
+    await transport.close()
+
+    latencies.sort()
+    stats = gateway.stats
+    print("calls:       %d ok, %d failed %r" % (len(latencies), sum(failures.values()), failures))
+    print("throughput:  %.0f calls/s over %.2fs" % (len(latencies) / elapsed, elapsed))
+    print("latency:     p50 %.2fms p99 %.2fms max %.2fms" % (
+        percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3,
+        (latencies[-1] if latencies else 0.0) * 1e3))
+    print("logins:      client %d, gateway %d" % (web_api.tokens.logins - logins, stats["logins"] - 1))
+    print("gateway:     %d requests, %d unauthorized, %d errors, %d timeouts, %d connections" % (
+        stats["requests"], stats["unauthorized"], stats["errors"], stats["timeouts"],
+        stats["connections"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--read-timeout', type=float, default=2.0)
+    parser.add_argument('--token-ttl', type=float)
+    parser.add_argument('--expire-every', type=float, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Send a rebalance worth of orders to a local FakeGateway, one at a time
+and through BulkExecutor.
+
+    python -m qig.bench.bulk_orders [--orders N] [--concurrency C] [--latency S]
+                                    [--timeout-rate P] [--duplicates P] [--confirm-window S]
+                                    [--verbose]
+
+Orders are a mix of open_positions, create_workingorders, close_positions
+and delete_workingorders over seeded deals. Reports completion time, per
+order latency, retries and what the gateway ended up holding.
+"""
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+from ..api import IGWebAPI
+from ..log import logger
+from ..bulk import Order, BulkExecutor
+from ..transport import Transport
+from .fake_gateway import FakeGateway
+from .api_load import EPICS, percentile
+
+
+def intents(rnd, count, positions, orders):
+    """(api_name, args) of count orders, closing/deleting the seeded deals.
+    """
+    result = []
+    positions = list(positions)
+    orders = list(orders)
+    for _ in range(count):
+        r = rnd.random()
+        epic = rnd.choice(EPICS)
+        direction = rnd.choice(['BUY', 'SELL'])
+        if r < 0.25 and positions:
+            deal_id, close = positions.pop()
+            result.append(('close_positions', (deal_id, close, None, None, None, 1, 'MARKET',
+                                               'FILL_OR_KILL')))
+        elif r < 0.4 and orders:
+            result.append(('delete_workingorders', (orders.pop(),)))
+        elif r < 0.7:
+            result.append(('create_workingorders', ('GBP', direction, epic, '-', False, False,
+                                                    1.0, 1, 'LIMIT', None, None, None, None,
+                                                    'GOOD_TILL_CANCELLED', None)))
+        else:
+            result.append(('open_positions', ('GBP', direction, epic, '-', False, False, None, 1,
+                                              'MARKET', None, None, None, None, 'FILL_OR_KILL',
+                                              False, None)))
+    return result
+
+
+async def session(args, seed_count):
+    gateway = FakeGateway(latency=args.latency, jitter=args.latency, timeout_rate=args.timeout_rate,
+                          hang=args.read_timeout * 2)
+    await gateway.start()
+    rnd = random.Random(1)
+    positions = [(gateway.add_position(rnd.choice(EPICS), 'BUY', 1), 'SELL')
+                 for _ in range(seed_count)]
+    orders = [gateway.add_order(rnd.choice(EPICS), 'BUY', 1, 1.0, 'LIMIT') for _ in range(seed_count)]
+    transport = Transport(limit=args.concurrency, limit_per_host=args.concurrency)
+    web_api = IGWebAPI(gateway.url, 'key', 'account', 'password', transport=transport,
+                       read_timeout=args.read_timeout, conn_timeout=5)
+    await web_api.log_in()
+    return gateway, web_api, transport, intents(random.Random(2), args.orders, positions, orders)
+
+
+def build(rnd, calls, duplicates):
+    built = []
+    for api_name, call_args in calls:
+        built.append(Order(api_name, *call_args))
+        if rnd.random() < duplicates:
+            built.append(built[-1])
+    return built
+
+
+def report(name, elapsed, latencies, failures, gateway):
+    latencies.sort()
+    print("%-10s %6.2fs  %7.0f orders/s  p50 %7.2fms p99 %7.2fms  failed %d" % (
+        name, elapsed, len(latencies) / elapsed, percentile(latencies, 0.5) * 1e3,
+        percentile(latencies, 0.99) * 1e3, failures))
+    print("           gateway: %d requests, %d timeouts, %d positions, %d orders" % (
+        gateway.stats["requests"], gateway.stats["timeouts"], len(gateway._positions),
+        len(gateway._orders)))
+
+
+async def sequential(args, seed_count):
+    gateway, web_api, transport, calls = await session(args, seed_count)
+    orders = build(random.Random(3), calls, args.duplicates)
+    latencies = []
+    failures = 0
+    started = time.perf_counter()
+    for order in orders:
+        t = time.perf_counter()
+        try:
+            await web_api.api(order.api_name, *order.call_args(), **order.kwargs)
+        except Exception:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    report("sequential", elapsed, latencies, failures, gateway)
+    await gateway.stop()
+    await web_api.close()
+    await transport.close()
+    return elapsed
+
+
+async def bulk(args, seed_count):
+    gateway, web_api, transport, calls = await session(args, seed_count)
+    orders = build(random.Random(3), calls, args.duplicates)
+    executor = BulkExecutor(web_api, concurrency=args.concurrency, retries=args.retries,
+                            confirm_window=args.confirm_window)
+    started = time.perf_counter()
+    results = await executor.run(orders)
+    elapsed = time.perf_counter() - started
+    sent = [result for result in results if not result.duplicate]
+    report("bulk", elapsed, [result.latency for result in sent if result.ok],
+           sum(1 for result in sent if not result.ok), gateway)
+    print("           %d duplicates dropped, %d retries, queued p50 %.2fms" % (
+        len(results) - len(sent), sum(result.attempts - 1 for result in sent),
+        percentile(sorted(result.queued for result in sent), 0.5) * 1e3))
+    await gateway.stop()
+    await web_api.close()
+    await transport.close()
+    return elapsed
+
+
+async def run(args):
+    seed_count = args.orders // 4
+    base = await sequential(args, seed_count)
+    elapsed = await bulk(args, seed_count)
+    print("speedup    %.1fx" % (base / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--read-timeout', type=float, default=1.0)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--duplicates', type=float, default=0.0)
+    parser.add_argument('--confirm-window', type=float, default=2.0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""In-process stand-in for IG's REST gateway.
+
+    python -m qig.bench.fake_gateway [--port 8081] [--latency 0.02] [--error-rate 0.01]
+
+Covers the /session, /markets, /prices, /positions, /workingorders,
+/confirms and /watchlists routes of IGWebAPI with canned data.
+"""
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import calendar
+from aiohttp import web
+
+
+__all__ = ['FakeGateway']
+
+
+RESOLUTION_SECONDS = {
+    "SECOND": 1, "MINUTE": 60, "MINUTE_2": 120, "MINUTE_3": 180, "MINUTE_5": 300,
+    "MINUTE_10": 600, "MINUTE_15": 900, "MINUTE_30": 1800, "HOUR": 3600,
+    "HOUR_2": 7200, "HOUR_3": 10800, "HOUR_4": 14400, "DAY": 86400,
+    "WEEK": 604800, "MONTH": 2592000,
+}
+PUBLIC_ROUTES = frozenset([('POST', '/session')])
+
+
+def _format_utc(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts))
+
+
+def _parse_date(text):
+    text = text.replace('/', '-').replace(' ', 'T')
+    return calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class FakeGateway:
+    """Fake IG REST gateway.
+
+    - latency: seconds added to every response, plus up to `jitter`
+    - error_rate: share of requests answered with `error_status`
+    - timeout_rate: share of requests held for `hang` seconds, longer than
+      the client's read timeout
+    - token_ttl: seconds a CST/X-SECURITY-TOKEN pair is accepted, None
+      for no expiry; expire_tokens() drops all of them at once
+    - add_position()/add_order() seed deals without a request
+    - stats counts requests, logins, 401s, injected errors and timeouts and
+      distinct client connections
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, timeout_rate=0.0, hang=30.0, token_ttl=None, seed=1):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.token_ttl = token_ttl
+        self._random = random.Random(seed)
+        self._tokens = {}
+        self._runner = None
+        self._closing = None
+        self._connections = set()
+        self._positions = {}
+        self._orders = {}
+        self._confirms = {}
+        self._watchlists = {}
+        self.stats = {"requests": 0, "logins": 0, "unauthorized": 0, "errors": 0,
+                      "timeouts": 0, "connections": 0}
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    async def start(self):
+        app = web.Application(middlewares=[self._middleware])
+        add = app.router.add_route
+        add('POST', '/session', self._log_in)
+        add('GET', '/session', self._session_detail)
+        add('DELETE', '/session', self._log_out)
+        add('GET', '/accounts', self._accounts)
+        add('GET', '/markets', self._markets)
+        add('GET', '/markets/{epic}', self._market)
+        add('GET', '/prices/{epic}', self._prices)
+        add('GET', '/positions', self._all_positions)
+        add('GET', '/positions/{deal_id}', self._position)
+        add('POST', '/positions/otc', self._open_position)
+        add('DELETE', '/positions/otc', self._close_position)
+        add('PUT', '/positions/otc/{deal_id}', self._update_position)
+        add('GET', '/workingorders', self._all_orders)
+        add('POST', '/workingorders/otc', self._create_order)
+        add('PUT', '/workingorders/otc/{deal_id}', self._update_order)
+        add('DELETE', '/workingorders/otc/{deal_id}', self._delete_order)
+        add('GET', '/confirms/{deal_reference}', self._confirm)
+        add('GET', '/watchlists', self._all_watchlists)
+        add('POST', '/watchlists', self._create_watchlist)
+        add('GET', '/watchlists/{watchlist_id}', self._watchlist)
+        add('PUT', '/watchlists/{watchlist_id}', self._add_to_watchlist)
+        add('DELETE', '/watchlists/{watchlist_id}', self._delete_watchlist)
+        add('DELETE', '/watchlists/{watchlist_id}/{epic}', self._remove_from_watchlist)
+        self._closing = asyncio.Event()
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            self._closing.set()
+            await self._runner.cleanup()
+            self._runner = None
+
+    def expire_tokens(self):
+        self._tokens.clear()
+
+    def add_position(self, epic, direction, size, level=None, deal_id=None, deal_reference=None,
+                     currency=None):
+        deal_id = deal_id or "DIAAA" + uuid.uuid4().hex[:10].upper()
+        self._positions[deal_id] = {
+            "position": {"dealId": deal_id, "dealReference": deal_reference,
+                         "direction": direction, "size": size, "level": level, "currency": currency},
+            "market": {"epic": epic},
+        }
+        return deal_id
+
+    def add_order(self, epic, direction, size, level=None, order_type=None, deal_id=None):
+        deal_id = deal_id or "DIAAA" + uuid.uuid4().hex[:10].upper()
+        self._orders[deal_id] = {
+            "workingOrderData": {"dealId": deal_id, "direction": direction, "epic": epic,
+                                 "orderSize": size, "orderLevel": level, "orderType": order_type},
+            "marketData": {"epic": epic},
+        }
+        return deal_id
+
+    def _authorized(self, request):
+        issued = self._tokens.get(request.headers.get("CST"))
+        if issued is None:
+            return False
+        if self.token_ttl is not None and time.monotonic() - issued > self.token_ttl:
+            del self._tokens[request.headers["CST"]]
+            return False
+        return True
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.stats["requests"] += 1
+        peer = request.transport.get_extra_info('peername') if request.transport else None
+        if peer not in self._connections:
+            self._connections.add(peer)
+            self.stats["connections"] += 1
+
+        # the body is read first, a held request is still applied once the client gave up
+        await request.read()
+        delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0)
+        if self.timeout_rate and self._random.random() < self.timeout_rate:
+            self.stats["timeouts"] += 1
+            delay += self.hang
+        if delay:
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        if (request.method, request.path) not in PUBLIC_ROUTES and not self._authorized(request):
+            self.stats["unauthorized"] += 1
+            return web.json_response({"errorCode": "error.security.oauth-token-invalid"}, status=401)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"errorCode": "error.public-api.failure"},
+                                     status=self.error_status)
+        return await handler(request)
+
+    # session
+
+    async def _log_in(self, request):
+        await request.read()
+        self.stats["logins"] += 1
+        cst = uuid.uuid4().hex
+        self._tokens[cst] = time.monotonic()
+        return web.json_response({"accountType": "CFD", "currentAccountId": "FAKE"},
+                                 headers={"CST": cst, "X-SECURITY-TOKEN": uuid.uuid4().hex})
+
+    async def _session_detail(self, request):
+        return web.json_response({"accountId": "FAKE", "clientId": "FAKE", "currency": "GBP",
+                                  "lightstreamerEndpoint": self.url})
+
+    async def _log_out(self, request):
+        self._tokens.pop(request.headers.get("CST"), None)
+        return web.json_response({})
+
+    async def _accounts(self, request):
+        return web.json_response({"accounts": [{
+            "accountId": "FAKE", "accountType": "CFD", "currency": "GBP", "preferred": True,
+            "balance": {"balance": 10000.0, "deposit": 0.0, "profitLoss": 0.0, "available": 10000.0},
+        }]})
+
+    # markets
+
+    def _market_detail(self, epic):
+        bid = 1.0 + (hash(epic) % 1000) / 10000
+        return {
+            "instrument": {"epic": epic, "name": epic, "type": "CURRENCIES", "lotSize": 1.0},
+            "dealingRules": {"minDealSize": {"unit": "POINTS", "value": 0.5}},
+            "snapshot": {"marketStatus": "TRADEABLE", "bid": bid, "offer": bid + 0.0001,
+                         "updateTime": _format_utc(time.time())[11:]},
+        }
+
+    async def _markets(self, request):
+        epics = request.query.get("epics")
+        if epics is not None:
+            return web.json_response({"marketDetails": [
+                self._market_detail(epic) for epic in epics.split(',') if epic]})
+        term = request.query.get("searchTerm", "")
+        return web.json_response({"markets": [
+            dict(self._market_detail("CS.D.%s%d.CFD.IP" % (term.upper(), i))["snapshot"],
+                 epic="CS.D.%s%d.CFD.IP" % (term.upper(), i)) for i in range(10)]})
+
+    async def _market(self, request):
+        return web.json_response(self._market_detail(request.match_info["epic"]))
+
+    async def _prices(self, request):
+        query = request.query
+        step = RESOLUTION_SECONDS[query.get("resolution", "MINUTE")]
+        page_size = int(query.get("pageSize", 20))
+        page_num = int(query.get("pageNumber", 1))
+        if query.get("from") and query.get("to"):
+            start, end = _parse_date(query["from"]), _parse_date(query["to"])
+            total = max(0, (end - start) // step + 1)
+        else:
+            total = int(query.get("max", 10))
+            start = (int(time.time()) // step - total + 1) * step
+        if page_size:
+            first, last = (page_num - 1) * page_size, min(total, page_num * page_size)
+            pages = max(1, -(-total // page_size))
+        else:
+            first, last, pages = 0, total, 1
+        prices = []
+        for i in range(first, last):
+            ts = start + i * step
+            mid = 1.1 + (ts // step % 200) / 10000
+            price = lambda d: {"bid": mid + d, "ask": mid + d + 0.0001, "lastTraded": None}
+            prices.append({
+                "snapshotTime": _format_utc(ts).replace('-', '/').replace('T', ' '),
+                "snapshotTimeUTC": _format_utc(ts),
+                "openPrice": price(0), "highPrice": price(0.0005),
+                "lowPrice": price(-0.0005), "closePrice": price(0.0001),
+                "lastTradedVolume": 100 + i % 50,
+            })
+        return web.json_response({"prices": prices, "instrumentType": "CURRENCIES", "metadata": {
+            "allowance": {"remainingAllowance": 10000, "totalAllowance": 10000,
+                          "allowanceExpiry": 600000},
+            "size": len(prices),
+            "pageData": {"pageSize": page_size, "pageNumber": page_num, "totalPages": pages},
+        }})
+
+    # dealing
+
+    def _accept(self, deal_id=None, status="OPEN", **kwargs):
+        deal_reference = kwargs.pop("dealReference", None) or uuid.uuid4().hex[:15].upper()
+        deal_id = deal_id or "DIAAA" + uuid.uuid4().hex[:10].upper()
+        self._confirms[deal_reference] = dict(kwargs, dealReference=deal_reference, dealId=deal_id,
+                                              dealStatus="ACCEPTED", status=status, reason="SUCCESS",
+                                              date=_format_utc(time.time()))
+        return deal_reference, deal_id
+
+    async def _all_positions(self, request):
+        return web.json_response({"positions": list(self._positions.values())})
+
+    async def _position(self, request):
+        position = self._positions.get(request.match_info["deal_id"])
+        if position is None:
+            return web.json_response({"errorCode": "error.position.notfound"}, status=404)
+        return web.json_response(position)
+
+    async def _open_position(self, request):
+        data = await request.json()
+        deal_reference, deal_id = self._accept(
+            dealReference=data.get("dealReference"), epic=data.get("epic"),
+            direction=data.get("direction"), size=data.get("size"), level=data.get("level"))
+        self.add_position(data.get("epic"), data.get("direction"), data.get("size"), data.get("level"),
+                          deal_id, deal_reference, data.get("currencyCode"))
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _close_position(self, request):
+        data = await request.json()
+        position = self._positions.get(data.get("dealId"))
+        if position is None:
+            return web.json_response({"errorCode": "error.position.notfound"}, status=404)
+        size = data.get("size")
+        if size is not None and size < position["position"]["size"]:
+            position["position"]["size"] -= size
+        else:
+            del self._positions[data.get("dealId")]
+        deal_reference, _ = self._accept(data.get("dealId"), status="CLOSED",
+                                         epic=position["market"]["epic"],
+                                         direction=data.get("direction"), size=data.get("size"))
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _update_position(self, request):
+        data = await request.json()
+        deal_id = request.match_info["deal_id"]
+        position = self._positions.get(deal_id)
+        if position is None:
+            return web.json_response({"errorCode": "error.position.notfound"}, status=404)
+        position["position"].update(limitLevel=data.get("limitLevel"), stopLevel=data.get("stopLevel"))
+        deal_reference, _ = self._accept(deal_id, status="AMENDED", epic=position["market"]["epic"])
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _all_orders(self, request):
+        return web.json_response({"workingOrders": list(self._orders.values())})
+
+    async def _create_order(self, request):
+        data = await request.json()
+        deal_reference, deal_id = self._accept(
+            dealReference=data.get("dealReference"), epic=data.get("epic"),
+            direction=data.get("direction"), size=data.get("size"), level=data.get("level"))
+        self.add_order(data.get("epic"), data.get("direction"), data.get("size"), data.get("level"),
+                       data.get("type"), deal_id)
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _update_order(self, request):
+        data = await request.json()
+        deal_id = request.match_info["deal_id"]
+        order = self._orders.get(deal_id)
+        if order is None:
+            return web.json_response({"errorCode": "error.order.notfound"}, status=404)
+        order["workingOrderData"].update(orderLevel=data.get("level"), orderType=data.get("type"))
+        deal_reference, _ = self._accept(deal_id, status="AMENDED")
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _delete_order(self, request):
+        await request.read()
+        deal_id = request.match_info["deal_id"]
+        if self._orders.pop(deal_id, None) is None:
+            return web.json_response({"errorCode": "error.order.notfound"}, status=404)
+        deal_reference, _ = self._accept(deal_id, status="DELETED")
+        return web.json_response({"dealReference": deal_reference})
+
+    async def _confirm(self, request):
+        confirm = self._confirms.get(request.match_info["deal_reference"])
+        if confirm is None:
+            return web.json_response({"errorCode": "error.confirms.deal-not-found"}, status=404)
+        return web.json_response(confirm)
+
+    # watchlists
+
+    async def _all_watchlists(self, request):
+        return web.json_response({"watchlists": [
+            {"id": k, "name": v["name"], "editable": True, "deleteable": True}
+            for k, v in self._watchlists.items()]})
+
+    async def _create_watchlist(self, request):
+        data = await request.json()
+        watchlist_id = str(len(self._watchlists) + 1)
+        self._watchlists[watchlist_id] = {"name": data.get("name"), "epics": list(data.get("epics", []))}
+        return web.json_response({"watchlistId": watchlist_id, "status": "SUCCESS"})
+
+    def _get_watchlist(self, request):
+        return self._watchlists.get(request.match_info["watchlist_id"])
+
+    async def _watchlist(self, request):
+        watchlist = self._get_watchlist(request)
+        if watchlist is None:
+            return web.json_response({"errorCode": "error.watchlists.not-found"}, status=404)
+        return web.json_response({"markets": [self._market_detail(epic)["snapshot"]
+                                              for epic in watchlist["epics"]]})
+
+    async def _add_to_watchlist(self, request):
+        data = await request.json()
+        watchlist = self._get_watchlist(request)
+        if watchlist is None:
+            return web.json_response({"errorCode": "error.watchlists.not-found"}, status=404)
+        watchlist["epics"].append(data.get("epic"))
+        return web.json_response({"status": "SUCCESS"})
+
+    async def _delete_watchlist(self, request):
+        if self._watchlists.pop(request.match_info["watchlist_id"], None) is None:
+            return web.json_response({"errorCode": "error.watchlists.not-found"}, status=404)
+        return web.json_response({"status": "SUCCESS"})
+
+    async def _remove_from_watchlist(self, request):
+        watchlist = self._get_watchlist(request)
+        epic = request.match_info["epic"]
+        if watchlist is None or epic not in watchlist["epics"]:
+            return web.json_response({"errorCode": "error.watchlists.not-found"}, status=404)
+        watchlist["epics"].remove(epic)
+        return web.json_response({"status": "SUCCESS"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--token-ttl', type=float)
+    args = parser.parse_args(argv)
+
+    gateway = FakeGateway(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, timeout_rate=args.timeout_rate,
+                          token_ttl=args.token_ttl)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(gateway.start())
+    print("serving on %s" % gateway.url)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(gateway.stop())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Local stand-in for IG's session endpoint and Lightstreamer server.
+
+    python -m qig.bench.fake_lightstreamer [--port 8080] [--rate 1000] [--replay recorded.txt]
+
+Serves POST/GET /session and the create_session/bind_session/control
+text endpoints used by IGStreamAPI, so it can point api_prefix at it.
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import parse_qsl
+from aiohttp import web
+
+
+__all__ = ['FakeLightstreamer', 'STAMP_FIELD']
+
+
+STAMP_FIELD = 'BENCH_TS'
+UPDATE_TIME_FIELD = 'UPDATE_TIME'
+EVENTS = ('LOOP', 'END', 'ERROR', 'SYNC ERROR')
+CST = 'fake-cst'
+XST = 'fake-xst'
+
+
+class _Session:
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.tables = {}
+        self.bound = False
+        self.event = None
+        self.sent = 0
+
+
+class FakeLightstreamer:
+    """Fake Lightstreamer server replaying ticks to subscribed tables.
+
+    - rate: update lines/s per session, 0 sends as fast as possible
+    - lines: recorded `sub_id,item|f1|f2...` lines, the n-th recorded
+      sub_id feeds the n-th added table, else updates are synthetic
+    - schedule: (seconds, event) pairs, event is one of EVENTS, seconds
+      count from start(); LOOP and END end the stream of every session
+    - A STAMP_FIELD field in a schema carries time.time() of the write,
+      UPDATE_TIME carries the UTC time of day
+    - stats counts sessions, binds, control requests and lines sent
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, rate=1000, lines=None, schedule=(),
+                 interval=0.01, keepalive=5.0, seed=1):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.interval = interval
+        self.keepalive = keepalive
+        self._lines = lines
+        self._schedule = sorted(schedule)
+        self._random = random.Random(seed)
+        self._sessions = {}
+        self._last_session_id = 0
+        self._runner = None
+        self._tasks = []
+        self._started = None
+        self.stats = {"sessions": 0, "binds": 0, "controls": 0, "lines": 0, "events": []}
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/session', self._log_in)
+        app.router.add_get('/session', self._session_detail)
+        app.router.add_post('/lightstreamer/create_session.txt', self._create_session)
+        app.router.add_post('/lightstreamer/bind_session.txt', self._bind_session)
+        app.router.add_post('/lightstreamer/control.txt', self._control)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+        self._started = time.monotonic()
+        self._tasks.append(asyncio.ensure_future(self._run_schedule()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for session in self._sessions.values():
+            session.event = "END 31\r\n"
+        self._sessions = {}
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # REST
+
+    async def _log_in(self, request):
+        await request.read()
+        return web.json_response({"accountType": "CFD", "currentAccountId": "FAKE"},
+                                 headers={"CST": CST, "X-SECURITY-TOKEN": XST})
+
+    async def _session_detail(self, request):
+        if request.headers.get("CST") != CST:
+            return web.json_response({"errorCode": "error.security.client-token-missing"},
+                                     status=401)
+        return web.json_response({"accountId": "FAKE", "clientId": "FAKE",
+                                  "lightstreamerEndpoint": self.url})
+
+    # Lightstreamer
+
+    async def _create_session(self, request):
+        await request.post()
+        self._last_session_id += 1
+        session = _Session('S%d' % self._last_session_id)
+        self._sessions[session.session_id] = session
+        self.stats["sessions"] += 1
+        return await self._stream(request, session)
+
+    async def _bind_session(self, request):
+        form = await request.post()
+        session = self._sessions.get(form.get("LS_session"))
+        if session is None:
+            return web.Response(text="SYNC ERROR\r\n")
+        self.stats["binds"] += 1
+        return await self._stream(request, session)
+
+    async def _control(self, request):
+        body = await request.text()
+        replies = []
+        for line in body.split('\r\n'):
+            if not line:
+                continue
+            self.stats["controls"] += 1
+            dct = dict(parse_qsl(line))
+            session = self._sessions.get(dct.get("LS_session"))
+            if session is None:
+                replies.append("SYNC ERROR")
+                continue
+            table = int(dct["LS_Table"])
+            if dct.get("LS_op") == "add":
+                session.tables[table] = (dct["LS_schema"].split(' '), dct["LS_id"].split(' '))
+            else:
+                session.tables.pop(table, None)
+            replies.append("OK")
+        return web.Response(text="\r\n".join(replies) + "\r\n")
+
+    async def _stream(self, request, session):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        await resp.write(("OK\r\nSessionId:%s\r\nKeepaliveMillis:%d\r\n\r\n"
+                          % (session.session_id, self.keepalive * 1000)).encode('utf-8'))
+        session.bound = True
+        session.event = None
+        try:
+            await self._pump(session, resp)
+        except ConnectionError:
+            pass
+        finally:
+            session.bound = False
+        return resp
+
+    async def _pump(self, session, resp):
+        start, sent, idle = time.monotonic(), 0, 0.0
+        while True:
+            await asyncio.sleep(self.interval if self.rate else 0)
+            if session.event is not None:
+                await resp.write(session.event.encode('utf-8'))
+                await resp.write_eof()
+                return
+            if not session.tables:
+                idle += self.interval
+                if idle >= self.keepalive:
+                    idle = 0.0
+                    await resp.write(b"PROBE\r\n")
+                continue
+            if self.rate:
+                count = int((time.monotonic() - start) * self.rate) - sent
+            else:
+                count = 500
+            if count <= 0:
+                continue
+            lines = self._updates(session, count)
+            await resp.write(("\r\n".join(lines) + "\r\n").encode('utf-8'))
+            sent += count
+            self.stats["lines"] += count
+
+    def _updates(self, session, count):
+        tables = sorted(session.tables)
+        rnd = self._random
+        lines = []
+        for _ in range(count):
+            if self._lines:
+                sub_id, _, body = self._lines[session.sent % len(self._lines)].partition(',')
+                table = tables[(int(sub_id) - 1) % len(tables)]
+                fields, items = session.tables[table]
+                values = body.split('|')
+                values.extend([''] * (len(fields) + 1 - len(values)))
+            else:
+                table = tables[rnd.randrange(len(tables))]
+                fields, items = session.tables[table]
+                values = [str(rnd.randint(1, len(items)))]
+                for _ in fields:
+                    values.append('' if rnd.random() < 0.3 else '%.5f' % rnd.uniform(1, 2))
+            if STAMP_FIELD in fields:
+                values[fields.index(STAMP_FIELD) + 1] = repr(time.time())
+            if UPDATE_TIME_FIELD in fields:
+                values[fields.index(UPDATE_TIME_FIELD) + 1] = time.strftime('%H:%M:%S', time.gmtime())
+            session.sent += 1
+            lines.append('%d,%s' % (table, '|'.join(values)))
+        return lines
+
+    def inject(self, event):
+        """Send `event` to every bound session on its next write.
+        """
+        assert event in EVENTS, "unknown event %s" % event
+        self.stats["events"].append((time.monotonic() - self._started, event))
+        for session_id, session in list(self._sessions.items()):
+            if not session.bound:
+                continue
+            if event == 'LOOP':
+                session.event = "LOOP 0\r\n"
+            else:
+                session.event = "END 31\r\n" if event == 'END' else "%s\r\n" % event
+                del self._sessions[session_id]
+
+    async def _run_schedule(self):
+        for at, event in self._schedule:
+            await asyncio.sleep(max(0, self._started + at - time.monotonic()))
+            self.inject(event)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--replay')
+    parser.add_argument('--loop-every', type=float, default=0)
+    parser.add_argument('--end-every', type=float, default=0)
+    parser.add_argument('--duration', type=float, default=3600)
+    args = parser.parse_args(argv)
+
+    lines = None
+    if args.replay:
+        with open(args.replay) as f:
+            lines = [line.rstrip('\r\n') for line in f if ',' in line]
+    schedule = every(args.loop_every, 'LOOP', args.duration) + every(args.end_every, 'END', args.duration)
+    server = FakeLightstreamer(args.host, args.port, rate=args.rate, lines=lines, schedule=schedule)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    print("serving on %s" % server.url)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+
+
+def every(period, event, duration):
+    if not period:
+        return []
+    return [(period * i, event) for i in range(1, int(duration / period) + 1)]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Decode REST payloads with each installed JSON backend.
+
+    python -m qig.bench.json_decode [payload.json ...] [--repeat N]
+
+Without files synthetic prices, positions, market navigation and history
+pages are used. The baseline is what resp.json() did: decode the body to
+str, then stdlib json.loads.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from ..serializer import Serializer, BACKENDS, orjson, ujson
+
+
+def synthetic_payloads(seed=1):
+    rnd = random.Random(seed)
+
+    def price():
+        bid = round(rnd.uniform(1, 2), 5)
+        return {"bid": bid, "ask": round(bid + 0.0001, 5), "lastTraded": None}
+
+    prices = {"prices": [{
+        "snapshotTime": "2017/06/14 09:%02d:00" % (i % 60),
+        "snapshotTimeUTC": "2017-06-14T08:%02d:00" % (i % 60),
+        "openPrice": price(), "closePrice": price(), "highPrice": price(), "lowPrice": price(),
+        "lastTradedVolume": rnd.randint(0, 500),
+    } for i in range(1000)], "instrumentType": "CURRENCIES", "metadata": {
+        "allowance": {"remainingAllowance": 9999, "totalAllowance": 10000, "allowanceExpiry": 600},
+        "size": 1000, "pageData": {"pageSize": 1000, "pageNumber": 1, "totalPages": 1}}}
+    positions = {"positions": [{
+        "position": {"contractSize": 1.0, "createdDate": "2017/06/14 09:30:00:000",
+                     "createdDateUTC": "2017-06-14T08:30:00", "dealId": "DIAAAAB%08d" % i,
+                     "dealReference": "REF%d" % i, "size": 1.0, "direction": "BUY",
+                     "limitLevel": None, "level": 1.12, "currency": "USD",
+                     "controlledRisk": False, "stopLevel": None, "trailingStep": None,
+                     "trailingStopDistance": None, "limitedRiskPremium": None},
+        "market": {"instrumentName": "EUR/USD Mini", "expiry": "-", "epic": "CS.D.EURUSD.MINI.IP",
+                   "instrumentType": "CURRENCIES", "lotSize": 1.0, "high": 1.13, "low": 1.11,
+                   "percentageChange": 0.1, "netChange": 0.001, "bid": 1.12, "offer": 1.1201,
+                   "updateTime": "09:30:00", "updateTimeUTC": "08:30:00", "delayTime": 0,
+                   "streamingPricesAvailable": True, "marketStatus": "TRADEABLE",
+                   "scalingFactor": 10000},
+    } for i in range(300)]}
+    navigation = {"nodes": [{"id": str(i), "name": u"Node é %d" % i} for i in range(200)],
+                  "markets": [dict(positions["positions"][i % 300]["market"], epic="EPIC%d" % i)
+                              for i in range(500)]}
+    history = {"activities": [{
+        "date": "2017-06-14T09:30:00", "epic": "CS.D.EURUSD.MINI.IP", "period": "-",
+        "dealId": "DIAAAAB%08d" % i, "channel": "PUBLIC_WEB_API", "type": "POSITION",
+        "status": "ACCEPTED", "description": "Position opened: %d" % i,
+        "details": {"dealReference": "REF%d" % i, "actions": [{"actionType": "POSITION_OPENED",
+                                                              "affectedDealId": "DIAAAAB%08d" % i}],
+                    "marketName": "EUR/USD Mini", "currency": "USD", "size": 1.0,
+                    "direction": "BUY", "level": 1.12, "stopLevel": None, "limitLevel": None},
+    } for i in range(500)], "metadata": {"paging": {"size": 500, "next": None}}}
+    return [
+        ('prices', json.dumps(prices).encode('utf-8')),
+        ('get_all_positions', json.dumps(positions).encode('utf-8')),
+        ('market_navigation', json.dumps(navigation, ensure_ascii=False).encode('utf-8')),
+        ('history_activity', json.dumps(history).encode('utf-8')),
+    ]
+
+
+def best_of(func, body, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(body)
+        cost = time.perf_counter() - t
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        payloads = []
+        for path in args.paths:
+            with open(path, 'rb') as f:
+                payloads.append((path, f.read()))
+    else:
+        payloads = synthetic_payloads()
+    installed = {'orjson': orjson is not None, 'ujson': ujson is not None, 'json': True}
+    serializers = [Serializer(name) for name in BACKENDS if installed[name]]
+    baseline = lambda body: json.loads(body.decode('utf-8'))
+
+    for name, body in payloads:
+        base = best_of(baseline, body, args.repeat)
+        expect = baseline(body)
+        print("%-20s %8.1f KB  resp.json %8.2f ms" % (name, len(body) / 1024, base * 1e3))
+        for serializer in serializers:
+            assert serializer.loads(body) == expect, serializer
+            cost = best_of(serializer.loads, body, args.repeat)
+            print("    %-8s loads %8.2f ms  %5.2fx" % (serializer.name, cost * 1e3, base / cost))
+        data = expect
+        base = best_of(json.dumps, data, args.repeat)
+        for serializer in serializers:
+            cost = best_of(serializer.dumps, data, args.repeat)
+            print("    %-8s dumps %8.2f ms  %5.2fx" % (serializer.name, cost * 1e3, base / cost))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Convert decoded /prices, market detail and sentiment responses to columns.
+
+    python -m qig.bench.numpy_convert [--candles N] [--markets N] [--repeat N]
+
+Compares the per-candle dict walk analytics code does, prices.candle_columns
+(stdlib arrays) and converters.prices_array, and the memory held by the
+decoded response against the converted columns.
+"""
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from ..prices import candle_columns, parse_utc
+from ..converters import prices_array, market_details_array, sentiments_array, np
+from .json_decode import best_of
+
+
+def synthetic_prices(count, seed=1):
+    rnd = random.Random(seed)
+    start = 1497000000
+    prices = []
+    for i in range(count):
+        bid = round(rnd.uniform(1, 2), 5)
+        price = {"bid": bid, "ask": round(bid + 0.0001, 5), "lastTraded": None}
+        ts = time.gmtime(start + i * 60)
+        prices.append({
+            "snapshotTime": time.strftime('%Y/%m/%d %H:%M:%S', ts),
+            "snapshotTimeUTC": time.strftime('%Y-%m-%dT%H:%M:%S', ts),
+            "openPrice": dict(price), "closePrice": dict(price), "highPrice": dict(price),
+            "lowPrice": dict(price), "lastTradedVolume": rnd.randint(0, 500),
+        })
+    return {"prices": prices}
+
+
+def synthetic_markets(count):
+    return {"marketDetails": [{
+        "instrument": {"epic": "CS.D.EPIC%d.CFD.IP" % i, "name": "Market %d" % i},
+        "snapshot": {"marketStatus": "TRADEABLE", "bid": 1.1 + i / 1e4, "offer": 1.1001 + i / 1e4,
+                     "high": 1.2, "low": 1.0, "netChange": 0.01, "percentageChange": 0.5,
+                     "updateTime": "09:30:%02d" % (i % 60), "delayTime": 0, "scalingFactor": 10000},
+    } for i in range(count)], "errors": []}
+
+
+def synthetic_sentiments(count):
+    return {"clientSentiments": [{"marketId": "MARKET%d" % i, "longPositionPercentage": 60.0,
+                                  "shortPositionPercentage": 40.0} for i in range(count)]}
+
+
+def dict_walk(info):
+    """What analytics did: one list per column, filled candle by candle.
+    """
+    cols = dict([(name, []) for name in ('time', 'bid_open', 'bid_high', 'bid_low', 'bid_close',
+                                         'ask_open', 'ask_high', 'ask_low', 'ask_close', 'volume')])
+    for candle in info['prices']:
+        cols['time'].append(parse_utc(candle['snapshotTimeUTC']))
+        for name, key in (('open', 'openPrice'), ('high', 'highPrice'), ('low', 'lowPrice'),
+                          ('close', 'closePrice')):
+            cols['bid_' + name].append(candle[key]['bid'])
+            cols['ask_' + name].append(candle[key]['ask'])
+        cols['volume'].append(candle['lastTradedVolume'])
+    return cols
+
+
+def held(func, *args):
+    """Bytes still allocated by the result of func(*args).
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func(*args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--candles', type=int, default=100000)
+    parser.add_argument('--markets', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if np is None:
+        print("numpy isn't installed")
+        return 1
+
+    info = synthetic_prices(args.candles)
+    base = best_of(dict_walk, info, args.repeat)
+    print("%d candles" % args.candles)
+    print("    dict walk      %8.2f ms" % (base * 1e3))
+    for name, func in (('candle_columns', lambda info: candle_columns(info['prices'])),
+                       ('prices_array', prices_array),
+                       ('columnar', lambda info: prices_array(info, columnar=True))):
+        cost = best_of(func, info, args.repeat)
+        print("    %-14s %8.2f ms  %5.2fx" % (name, cost * 1e3, base / cost))
+    print("    held: response %.1f MB, dict walk %.1f MB, prices_array %.1f MB" % (
+        held(synthetic_prices, args.candles) / 1e6, held(dict_walk, info) / 1e6,
+        held(prices_array, info) / 1e6))
+
+    markets = synthetic_markets(args.markets)
+    cost = best_of(market_details_array, markets, args.repeat)
+    print("%d market details  %8.2f ms" % (args.markets, cost * 1e3))
+    sentiments = synthetic_sentiments(args.markets)
+    cost = best_of(sentiments_array, sentiments, args.repeat)
+    print("%d sentiments      %8.2f ms" % (args.markets, cost * 1e3))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Publish ticks into a TickPublisher ring and read them from another process.
+
+    python -m qig.bench.shm_ring [--count N] [--rate R] [--capacity C]
+
+Reports reader throughput and publish-to-read latency. With --rate 0 the
+publisher writes as fast as it can, else it paces to R ticks/s.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from ..shm_ring import TickPublisher, TickReader
+
+
+FIELDS = ['BID', 'OFFER', 'HIGH', 'LOW', 'CHANGE', 'MARKET_STATE']
+KINDS = ['d', 'd', 'd', 'd', 'd', '12s']
+ITEMS = ['MARKET:CS.D.EURUSD%d.CFD.IP' % i for i in range(50)]
+
+
+def synthetic_infos(n=1000):
+    infos = []
+    for i in range(n):
+        bid = 1.1 + (i % 97) / 10000
+        infos.append({"name": ITEMS[i % len(ITEMS)], "values": {
+            "BID": '%.5f' % bid, "OFFER": '%.5f' % (bid + 0.0001), "HIGH": '1.1200',
+            "LOW": '1.0900', "CHANGE": '0.0012', "MARKET_STATE": 'TRADEABLE'}})
+    return infos
+
+
+def reader(name, count, ready, results):
+    ring = TickReader(name)
+    ready.set()
+    latencies = []
+    received = 0
+    first = None
+    while received + ring.lost < count:
+        records = ring.read()
+        if not records:
+            continue
+        now = time.time()
+        if first is None:
+            first = time.perf_counter()
+        received += len(records)
+        latencies.extend(now - record[1] for record in records[::16])
+    elapsed = time.perf_counter() - first
+    results.put((received, ring.lost, elapsed, sorted(latencies)))
+    ring.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=500000)
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--capacity', type=int, default=65536)
+    args = parser.parse_args(argv)
+
+    name = 'qig_bench_%d' % os.getpid()
+    ring = TickPublisher(name, FIELDS, ITEMS, kinds=KINDS, capacity=args.capacity)
+    ready, results = multiprocessing.Event(), multiprocessing.Queue()
+    proc = multiprocessing.Process(target=reader, args=(name, args.count, ready, results))
+    proc.start()
+    try:
+        ready.wait()
+        infos = synthetic_infos()
+        interval = 1.0 / args.rate if args.rate else 0
+        publish = ring.publish
+        t = time.perf_counter()
+        for i in range(args.count):
+            publish(infos[i % len(infos)])
+            if interval:
+                while time.perf_counter() - t < (i + 1) * interval:
+                    pass
+        publish_elapsed = time.perf_counter() - t
+        received, lost, elapsed, latencies = results.get()
+        proc.join()
+    finally:
+        ring.close()
+
+    print("published: %d in %.3fs, %12.0f ticks/s" % (args.count, publish_elapsed,
+                                                       args.count / publish_elapsed))
+    print("received:  %d, lost %d, %12.0f ticks/s" % (received, lost, received / elapsed))
+    print("latency:   p50 %.1fus p99 %.1fus max %.1fus" % (
+        percentile(latencies, 0.5) * 1e6, percentile(latencies, 0.99) * 1e6,
+        (latencies[-1] if latencies else 0.0) * 1e6))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
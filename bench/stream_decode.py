@@ -0,0 +1,164 @@
+"""Replay `sub_id,item|f1|f2...` lines through the stream decoder.
+
+    python -m qig.bench.stream_decode [recorded.txt] [--repeat N]
+
+Without a file a synthetic MERGE feed is generated.
+"""
+import sys
+import time
+import random
+import argparse
+from ..decoder import UpdateDecoder, TypedDecoder
+
+
+FIELDS = ['BID', 'OFFER', 'HIGH', 'LOW', 'MID_OPEN', 'CHANGE', 'CHANGE_PCT',
+          'UPDATE_TIME', 'MARKET_DELAY', 'MARKET_STATE']
+
+
+def synthetic_lines(n_subs=4, n_items=50, n_lines=200000, seed=1):
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        values = []
+        for field in FIELDS:
+            r = rnd.random()
+            if r < 0.5:
+                values.append('')
+            elif r < 0.55:
+                values.append('#')
+            elif r < 0.6:
+                values.append('$')
+            else:
+                values.append('%.5f' % rnd.uniform(1, 2))
+        lines.append('%d,%d|%s' % (rnd.randint(1, n_subs), rnd.randint(1, n_items), '|'.join(values)))
+    return lines
+
+
+def load_lines(path):
+    with open(path) as f:
+        return [line.rstrip('\r\n') for line in f if ',' in line]
+
+
+def build_confs(lines):
+    confs = {}
+    for line in lines:
+        sub_id, body = line.split(',', 1)
+        ls = body.split('|')
+        n_items, n_fields = confs.get(int(sub_id), (0, 0))
+        confs[int(sub_id)] = (max(n_items, int(ls[0])), max(n_fields, len(ls)-1))
+    return dict([
+        (sub_id, {'fields': ['F%d' % i for i in range(n_fields)],
+                  'items': ['ITEM%d' % i for i in range(n_items)]})
+        for sub_id, (n_items, n_fields) in confs.items()
+    ])
+
+
+class LegacyParser:
+    """Parser of IGStreamAPI before the per-subscription decoder."""
+
+    def __init__(self, confs):
+        self._subscribe_map = dict([(k, {'conf': v, 'items': {}}) for k, v in confs.items()])
+
+    def _data_decode(self, c_v, l_v):
+        if c_v == "$":
+            return u''
+        elif c_v == "#":
+            return None
+        elif not c_v:
+            return l_v
+        elif c_v[0] in "#$":
+            c_v = c_v[1:]
+        return c_v
+
+    def _data_parse(self, msg):
+        ls = msg.split(',', 1)
+        sub_id, item = int(ls[0]), ls[1]
+        ls = item.split("|")
+        item_pos = int(ls[0])
+        field_dct = dict(list(zip(self._subscribe_map[sub_id]['conf']['fields'], ls[1:])))
+
+        last_item = self._subscribe_map[sub_id]['items'].get(item_pos, {})
+        self._subscribe_map[sub_id]['items'][item_pos] = dict([
+            (k, self._data_decode(v, last_item.get(k))) for k, v in field_dct.items()
+        ])
+
+        item_info = {
+            "name": self._subscribe_map[sub_id]['conf']['items'][item_pos-1],
+            "values": self._subscribe_map[sub_id]['items'][item_pos]
+        }
+        return item_info
+
+
+class DecoderParser:
+    """Same path as IGStreamAPI._data_parse."""
+
+    def __init__(self, confs):
+        self._subscribe_map = dict([
+            (k, {'conf': v, 'decoder': UpdateDecoder(v['fields'], v['items'])})
+            for k, v in confs.items()
+        ])
+
+    def _data_parse(self, msg):
+        sub_id, _, body = msg.partition(',')
+        sub = self._subscribe_map.get(int(sub_id))
+        if sub is None:
+            return None
+        return sub['decoder'].decode(body)
+
+
+class TypedParser(DecoderParser):
+    """Typed records with all fields as float, recycled after each line."""
+
+    def __init__(self, confs):
+        self._subscribe_map = dict([
+            (k, {'conf': v, 'decoder': TypedDecoder(v['fields'], v['items'],
+                                                    dict.fromkeys(v['fields'], 'float'), pool=16)})
+            for k, v in confs.items()
+        ])
+
+    def _data_parse(self, msg):
+        rec = DecoderParser._data_parse(self, msg)
+        if rec is not None:
+            rec.release()
+        return rec
+
+
+def run(parser, lines, repeat):
+    parse = parser._data_parse
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for line in lines:
+            parse(line)
+        cost = time.perf_counter() - t
+        best = cost if best is None else min(best, cost)
+    return len(lines) / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    lines = load_lines(args.path) if args.path else synthetic_lines()
+    confs = build_confs(lines)
+
+    legacy, current = LegacyParser(confs), DecoderParser(confs)
+    for line in lines:
+        expect, got = legacy._data_parse(line), current._data_parse(line)
+        assert expect['name'] == got['name'], line
+        assert all(got['values'][k] == v for k, v in expect['values'].items()), line
+
+    legacy_rate = run(LegacyParser(confs), lines, args.repeat)
+    current_rate = run(DecoderParser(confs), lines, args.repeat)
+    typed_rate = run(TypedParser(confs), lines, args.repeat)
+    print("lines: %d" % len(lines))
+    print("legacy:  %12.0f lines/s" % legacy_rate)
+    print("decoder: %12.0f lines/s" % current_rate)
+    print("typed:   %12.0f lines/s" % typed_rate)
+    print("speedup: %12.2fx" % (current_rate / legacy_rate))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Run IGStreamAPI against a local FakeLightstreamer.
+
+    python -m qig.bench.stream_replay [recorded.txt] [--rate R] [--duration S]
+                                      [--loop-every S] [--end-every S] [--end-delay S]
+                                      [--verbose]
+
+Reports update throughput, handler latency percentiles (write on the fake
+server to handler call) and rebind/reconnect recovery times. --rate 0
+streams as fast as possible, which measures parse throughput.
+"""
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from ..log import logger
+from ..stream_api import IGStreamAPI
+from .fake_lightstreamer import FakeLightstreamer, STAMP_FIELD, every
+from .stream_decode import FIELDS, load_lines, build_confs
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def synthetic_confs(n_tables, n_items):
+    return dict([
+        (i + 1, {'fields': FIELDS, 'items': ['CS.D.ITEM%d.CFD.IP' % j for j in range(n_items)]})
+        for i in range(n_tables)
+    ])
+
+
+async def run(args, lines, confs):
+    schedule = every(args.loop_every, 'LOOP', args.duration) + \
+        every(args.end_every, 'END', args.duration)
+    server = FakeLightstreamer(rate=args.rate, lines=lines, schedule=schedule)
+    await server.start()
+
+    stream = IGStreamAPI(server.url, 'key', 'account', 'password', 'DEFAULT',
+                         queue_size=args.queue_size, end_delay=args.end_delay)
+    for sub_id in sorted(confs):
+        conf = confs[sub_id]
+        stream.subscribe({'mode': 'MERGE', 'items': conf['items'],
+                          'fields': list(conf['fields']) + [STAMP_FIELD]})
+
+    latencies = []
+    counts = {"updates": 0, "batches": 0}
+
+    async def on_batch(infos):
+        now = time.time()
+        counts["updates"] += len(infos)
+        counts["batches"] += 1
+        for info in infos[::8]:
+            latencies.append(now - float(info["values"][STAMP_FIELD]))
+
+    stream.add_batch_listener(on_batch)
+    task = asyncio.ensure_future(stream.start())
+    started = time.perf_counter()
+    error = None
+    try:
+        await asyncio.wait_for(asyncio.shield(task), args.duration)
+    except asyncio.TimeoutError:
+        pass
+    except Exception as exc:
+        error = exc
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    await server.stop()
+    await stream.close()
+
+    latencies.sort()
+    print("sent:       %d lines" % server.stats["lines"])
+    print("updates:    %d in %d batches, %.0f updates/s" % (
+        counts["updates"], counts["batches"], counts["updates"] / elapsed))
+    print("latency:    p50 %.2fms p90 %.2fms p99 %.2fms max %.2fms" % (
+        percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.9) * 1e3,
+        percentile(latencies, 0.99) * 1e3, (latencies[-1] if latencies else 0.0) * 1e3))
+    recovery = stream.recovery
+    print("recovery:   %d rebinds, %d reconnects, avg %.2fms max %.2fms" % (
+        recovery["rebinds"], recovery["reconnects"],
+        recovery["total"] / max(1, recovery["rebinds"] + recovery["reconnects"]) * 1e3,
+        recovery["max"] * 1e3))
+    print("server:     %d sessions, %d binds, %d controls" % (
+        server.stats["sessions"], server.stats["binds"], server.stats["controls"]))
+    if error is not None:
+        print("stopped by: %r" % error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--tables', type=int, default=4)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--queue-size', type=int, default=0)
+    parser.add_argument('--loop-every', type=float, default=0)
+    parser.add_argument('--end-every', type=float, default=0)
+    parser.add_argument('--end-delay', type=float, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+
+    if args.path:
+        lines = load_lines(args.path)
+        confs = build_confs(lines)
+    else:
+        lines = None
+        confs = synthetic_confs(args.tables, args.items)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args, lines, confs))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
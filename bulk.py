@@ -0,0 +1,274 @@
+import time
+import asyncio
+from .log import logger
+from .error import *
+from .deals import DealClient, REFERENCE_APIS, POLL_MIN, POLL_MAX, new_reference
+from .endpoints import ENDPOINTS
+
+
+__all__ = ['Order', 'OrderResult', 'BulkExecutor']
+
+
+ORDER_APIS = REFERENCE_APIS | frozenset(['close_positions', 'update_positions',
+                                         'delete_workingorders', 'update_workingorders'])
+DONE_ON_404_APIS = frozenset(['close_positions', 'delete_workingorders'])
+ORDER_ARGS = dict([(ep.name, ep.args) for ep in ENDPOINTS if ep.name in ORDER_APIS])
+CONCURRENCY = 20
+RETRIES = 3
+CONFIRM_WINDOW = 10
+
+
+class Order:
+    """One order intent, api_name and the arguments of that api after
+    deal_reference.
+
+    - open_positions/create_workingorders get a generated deal_reference
+      unless one is passed
+    - Orders with the same `key` are sent once: the deal_reference, or the
+      api name and arguments for the other apis
+    """
+
+    __slots__ = ('api_name', 'args', 'kwargs', 'deal_reference')
+
+    def __init__(self, api_name, *args, deal_reference=None, **kwargs):
+        assert api_name in ORDER_APIS, "api_name error @Order"
+        if api_name in REFERENCE_APIS and deal_reference is None:
+            deal_reference = new_reference()
+        self.api_name = api_name
+        self.args = args
+        self.kwargs = kwargs
+        self.deal_reference = deal_reference
+
+    @property
+    def key(self):
+        if self.deal_reference is not None:
+            return self.deal_reference
+        return (self.api_name, repr(self.args), repr(sorted(self.kwargs.items())))
+
+    def call_args(self):
+        if self.api_name in REFERENCE_APIS:
+            return (self.deal_reference,) + self.args
+        return self.args
+
+    def arg(self, name):
+        """Value of argument `name` of the api, None when not passed.
+        """
+        if name in self.kwargs:
+            return self.kwargs[name]
+        args = dict(zip(ORDER_ARGS[self.api_name], self.call_args()))
+        return args.get(name)
+
+    def __repr__(self):
+        return "<Order %s %s>" % (self.api_name, self.deal_reference or self.args[:1])
+
+
+class OrderResult:
+    """Outcome of one Order.
+
+    - response: what the api returned, confirm: the deal confirm when
+      confirmed, error: the exception that ended it
+    - queued: seconds waiting for a free slot, latency: seconds from the
+      first send to the end, attempts: sends including retries
+    - duplicate: True on results of orders dropped as duplicates, they share
+      response/confirm/error with the order that was sent
+    """
+
+    __slots__ = ('order', 'response', 'confirm', 'error', 'queued', 'latency', 'attempts',
+                 'duplicate')
+
+    def __init__(self, order, duplicate=False):
+        self.order = order
+        self.response = None
+        self.confirm = None
+        self.error = None
+        self.queued = 0.0
+        self.latency = 0.0
+        self.attempts = 0
+        self.duplicate = duplicate
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<OrderResult %r %s %d attempts %.3fs>" % (
+            self.order, "ok" if self.ok else repr(self.error), self.attempts, self.latency)
+
+
+class BulkExecutor:
+    """Send a list of orders concurrently through one IGWebAPI.
+
+    - At most `concurrency` orders in flight, the web_api's RateLimiter
+      still schedules every request
+    - An order with a deal_reference is never resent: after a timeout its
+      confirm is awaited for `confirm_window` seconds (confirm_deal polled
+      with backoff, see DealClient) and the order fails with
+      APITimeoutError when none arrived
+    - Other orders are retried up to `retries` times, a timed out close,
+      update or delete only once its position or working order still
+      shows it unapplied after `confirm_window` seconds. Position sizes are
+      taken with get_all_positions before a run with closes, so a partial
+      close is told from the size. When the state can't be told (lookups
+      failed, several closes of one deal in the run) the order fails with
+      APITimeoutError. A close or delete retried into a 404 counts as done
+    - With a DealClient, orders are only done once their deal confirm
+      arrives, see DealClient
+    - run() returns one OrderResult per order, in order
+    """
+
+    def __init__(self, web_api, deals=None, concurrency=CONCURRENCY, retries=RETRIES,
+                 confirm_window=CONFIRM_WINDOW):
+        self._web_api = web_api
+        self._deals = deals
+        self._confirmer = DealClient(web_api, timeout=confirm_window)
+        self._confirm_window = confirm_window
+        self._concurrency = concurrency
+        self._retries = retries
+        self._sizes = None
+        self._closes = {}
+
+    async def _snapshot(self, orders):
+        closes = {}
+        sent = dict([(order.key, order) for order in orders if order.api_name == 'close_positions'])
+        for order in sent.values():
+            deal_id = order.arg('dealid')
+            closes[deal_id] = closes.get(deal_id, 0) + 1
+        self._closes = closes
+        self._sizes = None
+        if not closes:
+            return
+        try:
+            info = await self._web_api.api('get_all_positions')
+        except Exception as exc:
+            logger.warning("No position sizes, timed out closes won't be resent: %r", exc)
+            return
+        self._sizes = dict([(item['position']['dealId'], item['position']['size'])
+                            for item in info.get('positions', [])])
+
+    async def _position(self, deal_id):
+        try:
+            info = await self._web_api.api('get_positions', deal_id)
+        except NotFoundError:
+            return None
+        return info['position']
+
+    async def _working_order(self, deal_id):
+        info = await self._web_api.api('get_all_workingorders')
+        for item in info.get('workingOrders', []):
+            if item['workingOrderData']['dealId'] == deal_id:
+                return item['workingOrderData']
+        return None
+
+    async def _applied(self, order):
+        """Whether a timed out close/update/delete took effect, None when
+        it can't be told. Looked up with backoff for `confirm_window`
+        seconds, the timed out request may still be on its way and lookups
+        can time out too.
+        """
+        deadline = time.monotonic() + self._confirm_window
+        delay = POLL_MIN
+        while True:
+            applied = await self._lookup(order)
+            if applied or time.monotonic() + delay > deadline:
+                return applied
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+
+    async def _lookup(self, order):
+        deal_id = order.arg('dealid')
+        try:
+            if order.api_name == 'close_positions':
+                position = await self._position(deal_id)
+                if position is None:
+                    return True
+                if self._sizes is None or deal_id not in self._sizes or \
+                        self._closes.get(deal_id, 0) > 1:
+                    return None
+                before = self._sizes[deal_id]
+                if position['size'] == before:
+                    return False
+                if position['size'] == before - order.arg('size'):
+                    return True
+                return None
+            if order.api_name == 'update_positions':
+                position = await self._position(deal_id)
+                return position is not None and \
+                    position.get('limitLevel') == order.arg('limit_level') and \
+                    position.get('stopLevel') == order.arg('stop_level')
+            working = await self._working_order(deal_id)
+            if order.api_name == 'delete_workingorders':
+                return working is None
+            return working is not None and \
+                working.get('orderLevel') == order.arg('level') and \
+                working.get('orderType') == order.arg('order_type')
+        except Exception as exc:
+            logger.warning("Lookup of %r failed: %r", order, exc)
+            return None
+
+    async def run(self, orders):
+        await self._snapshot(orders)
+        semaphore = asyncio.Semaphore(self._concurrency)
+        results = []
+        first = {}
+        tasks = []
+        for order in orders:
+            sent = first.get(order.key)
+            if sent is not None:
+                results.append(OrderResult(order, duplicate=True))
+                continue
+            result = first[order.key] = OrderResult(order)
+            results.append(result)
+            tasks.append(self._execute(semaphore, result))
+        await asyncio.gather(*tasks)
+        for result in results:
+            if result.duplicate:
+                sent = first[result.order.key]
+                result.response = sent.response
+                result.confirm = sent.confirm
+                result.error = sent.error
+        return results
+
+    async def _execute(self, semaphore, result):
+        started = time.perf_counter()
+        async with semaphore:
+            sending = time.perf_counter()
+            result.queued = sending - started
+            try:
+                await self._send(result)
+            except Exception as exc:
+                result.error = exc
+            result.latency = time.perf_counter() - sending
+
+    async def _send(self, result):
+        order = result.order
+        while True:
+            result.attempts += 1
+            try:
+                if self._deals is not None:
+                    result.confirm = await self._deals.submit(
+                        order.api_name, *order.args, deal_reference=order.deal_reference,
+                        **order.kwargs)
+                else:
+                    result.response = await self._web_api.api(order.api_name, *order.call_args(),
+                                                              **order.kwargs)
+                return
+            except APITimeoutError:
+                if result.attempts > self._retries:
+                    raise
+                if order.deal_reference is not None:
+                    # a late first send would still open a deal, never resend
+                    # DealClient already waited for the confirm of a timed out submit
+                    if self._deals is not None:
+                        raise
+                    result.confirm = await self._confirmer.confirm(order.deal_reference)
+                    return
+                applied = await self._applied(order)
+                if applied is None:
+                    raise
+                if applied:
+                    return
+                logger.warning("Retry %r after timeout", order)
+            except NotFoundError:
+                if result.attempts == 1 or order.api_name not in DONE_ON_404_APIS:
+                    raise
+                return
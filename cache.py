@@ -0,0 +1,118 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+__all__ = ['ResponseCache']
+
+
+DEFAULT_TTLS = {
+    'market_detail': 5,
+    'market_navigation': 300,
+    'client_sentiment': 30,
+    'accounts': 60,
+    'all_watchlist': 60,
+    'watchlist_detail': 60,
+}
+
+DEFAULT_INVALIDATES = {
+    'create_watchlist': ['all_watchlist'],
+    'delete_watchlist': ['all_watchlist', 'watchlist_detail'],
+    'add_market_to_watchlist': ['all_watchlist', 'watchlist_detail'],
+    'remove_market_from_watchlist': ['all_watchlist', 'watchlist_detail'],
+    'open_positions': ['accounts', 'get_all_positions'],
+    'close_positions': ['accounts', 'get_all_positions'],
+    'update_positions': ['get_all_positions', 'get_positions'],
+    'create_workingorders': ['accounts', 'get_all_workingorders'],
+    'delete_workingorders': ['accounts', 'get_all_workingorders'],
+    'update_workingorders': ['get_all_workingorders'],
+}
+
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+class ResponseCache:
+    """TTL/LRU cache for read-only endpoints of IGWebAPI.api.
+
+    - Only api names in `ttls` are cached, for ttls[api_name] seconds
+    - Concurrent identical calls share one in-flight request
+    - Calls listed in `invalidates` drop the cached entries of their targets
+    - Cached responses are shared between callers, don't mutate them
+    """
+
+    def __init__(self, ttls=None, maxsize=1024, invalidates=None):
+        self._ttls = DEFAULT_TTLS.copy() if ttls is None else dict(ttls)
+        self._invalidates = DEFAULT_INVALIDATES if invalidates is None else invalidates
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    def invalidate(self, api_name=None):
+        if api_name is None:
+            self._entries.clear()
+            self._generations.clear()
+            return
+        self._generations[api_name] = self._generations.get(api_name, 0) + 1
+        for key in [key for key in self._entries if key[0] == api_name]:
+            del self._entries[key]
+
+    def _store(self, key, generation, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self._generations.get(key[0], 0) != generation:
+            return
+        self._entries[key] = (time.monotonic() + self._ttls[key[0]], task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    async def call(self, api_name, args, kwargs, coro_func):
+        """Return cached result of api_name(*args, **kwargs) or await coro_func().
+        """
+        if api_name not in self._ttls:
+            result = await coro_func()
+            for target in self._invalidates.get(api_name, ()):
+                self.invalidate(target)
+            return result
+
+        key = (api_name, freeze(args), freeze(kwargs))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            generation = self._generations.get(api_name, 0)
+            task = asyncio.ensure_future(coro_func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._store(key, generation, t))
+        return await asyncio.shield(task)
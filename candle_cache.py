@@ -0,0 +1,163 @@
+import os
+import mmap
+import time
+import sqlite3
+from array import array
+from .prices import PricePager, COLUMNS
+
+
+__all__ = ['CandleCache', 'load_columns']
+
+
+RESOLUTION_SECONDS = {
+    "SECOND": 1, "MINUTE": 60, "MINUTE_2": 120, "MINUTE_3": 180, "MINUTE_5": 300,
+    "MINUTE_10": 600, "MINUTE_15": 900, "MINUTE_30": 1800, "HOUR": 3600,
+    "HOUR_2": 7200, "HOUR_3": 10800, "HOUR_4": 14400, "DAY": 86400,
+    "WEEK": 604800, "MONTH": 31 * 86400,
+}
+
+
+def format_utc(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts))
+
+
+def subtract_ranges(start, end, ranges):
+    """Parts of [start, end] not covered by sorted, merged `ranges`.
+    """
+    gaps = []
+    cursor = start
+    for r_start, r_end in ranges:
+        if r_end < cursor:
+            continue
+        if r_start > end:
+            break
+        if r_start > cursor:
+            gaps.append((cursor, r_start-1))
+        cursor = max(cursor, r_end+1)
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def column_type(name):
+    return 'q' if name in ('time', 'volume') else 'd'
+
+
+def load_columns(directory):
+    """Memory-map columns written by CandleCache.export, values are memoryviews.
+    """
+    cols = {}
+    for name in COLUMNS:
+        with open(os.path.join(directory, name + '.bin'), 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = b''
+        cols[name] = memoryview(buf).cast(column_type(name))
+    return cols
+
+
+def merge_ranges(ranges):
+    merged = []
+    for r_start, r_end in sorted(ranges):
+        if merged and r_start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return [tuple(r) for r in merged]
+
+
+class CandleCache:
+    """Local SQLite cache of /prices candles keyed by (epic, resolution).
+
+    - Stored time ranges are recorded, only the gaps are fetched from IG
+    - Ranges are recorded up to the last completed bar, a bar still
+      forming is fetched again on every fill
+    - Times are epoch seconds (UTC)
+    """
+
+    def __init__(self, path, web_api, page_size=500):
+        self._web_api = web_api
+        self._page_size = page_size
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS candles (epic TEXT, resolution TEXT, %s, "
+            "PRIMARY KEY (epic, resolution, time))" % ', '.join(COLUMNS))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ranges (epic TEXT, resolution TEXT, start_time INTEGER, end_time INTEGER)")
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def ranges(self, epic, resolution):
+        rows = self._db.execute(
+            "SELECT start_time, end_time FROM ranges WHERE epic=? AND resolution=? ORDER BY start_time",
+            (epic, resolution))
+        return [tuple(row) for row in rows]
+
+    def gaps(self, epic, resolution, start, end):
+        return subtract_ranges(start, end, self.ranges(epic, resolution))
+
+    def _store(self, epic, resolution, cols):
+        rows = zip(*[cols[name] for name in COLUMNS])
+        self._db.executemany(
+            "INSERT OR REPLACE INTO candles VALUES (?, ?, %s)" % ', '.join('?' * len(COLUMNS)),
+            ((epic, resolution) + tuple(row) for row in rows))
+        self._db.commit()
+
+    def _add_range(self, epic, resolution, start, end):
+        ranges = merge_ranges(self.ranges(epic, resolution) + [(start, end)])
+        self._db.execute("DELETE FROM ranges WHERE epic=? AND resolution=?", (epic, resolution))
+        self._db.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?)",
+                             [(epic, resolution, r_start, r_end) for r_start, r_end in ranges])
+        self._db.commit()
+
+    async def fill(self, epic, resolution, start, end):
+        """Fetch the missing parts of [start, end], return the fetched gaps.
+        """
+        now = int(time.time())
+        end = min(end, now)
+        # bars starting after this may still be forming, they are fetched again
+        complete = now - RESOLUTION_SECONDS[resolution]
+        gaps = self.gaps(epic, resolution, start, end)
+        for gap_start, gap_end in gaps:
+            pager = PricePager(self._web_api, epic, resolution, format_utc(gap_start),
+                               format_utc(gap_end), self._page_size, columnar=True)
+            try:
+                async for cols in pager:
+                    self._store(epic, resolution, cols)
+            finally:
+                await pager.aclose()
+            if gap_start <= min(gap_end, complete):
+                self._add_range(epic, resolution, gap_start, min(gap_end, complete))
+        return gaps
+
+    def read(self, epic, resolution, start, end, columnar=False):
+        """Read stored candles, rows of COLUMNS or a dict of arrays.
+        """
+        rows = self._db.execute(
+            "SELECT %s FROM candles WHERE epic=? AND resolution=? AND time BETWEEN ? AND ? "
+            "ORDER BY time" % ', '.join(COLUMNS), (epic, resolution, start, end)).fetchall()
+        if not columnar:
+            return rows
+        cols = {}
+        for i, name in enumerate(COLUMNS):
+            cols[name] = array(column_type(name), [row[i] for row in rows])
+        return cols
+
+    def export(self, epic, resolution, start, end, directory):
+        """Write stored candles as one raw file per column, see load_columns.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        cols = self.read(epic, resolution, start, end, columnar=True)
+        for name, values in cols.items():
+            with open(os.path.join(directory, name + '.bin'), 'wb') as f:
+                values.tofile(f)
+
+    async def get(self, epic, resolution, start, end, columnar=False):
+        await self.fill(epic, resolution, start, end)
+        return self.read(epic, resolution, start, end, columnar)
@@ -0,0 +1,331 @@
+import math
+import time
+import asyncio
+from array import array
+from .prices import PricePager, COLUMNS
+from .decoder import parse_time
+from .candle_cache import format_utc, column_type, RESOLUTION_SECONDS
+
+
+__all__ = ['CandleBuilder', 'CandleRing', 'RESOLUTION_SECONDS']
+
+
+# IG's weeks and months don't fall on fixed multiples of the epoch
+CALENDAR_RESOLUTIONS = frozenset(['WEEK', 'MONTH'])
+CAPACITY = 1440
+DAY = 86400
+TICK_FIELDS = ['BID', 'OFR', 'LTV', 'UTM']
+MARKET_FIELDS = ['BID', 'OFFER', 'UPDATE_TIME']
+BACKFILL_PAGE = 500
+# positions in a bar row, laid out as COLUMNS
+TIME, BID_OPEN, BID_HIGH, BID_LOW, BID_CLOSE, ASK_OPEN, ASK_HIGH, ASK_LOW, ASK_CLOSE, VOLUME = \
+    range(len(COLUMNS))
+
+
+def _number(v):
+    if v is None or v == '':
+        return math.nan
+    return float(v)
+
+
+def _high(a, b):
+    return b if math.isnan(a) or b > a else a
+
+
+def _low(a, b):
+    return b if math.isnan(a) or b < a else a
+
+
+def _join(bar, row):
+    """Complete `bar` built from ticks since its middle with the full
+    history bar `row`.
+    """
+    bar[BID_OPEN] = row[BID_OPEN]
+    bar[ASK_OPEN] = row[ASK_OPEN]
+    bar[BID_HIGH] = _high(bar[BID_HIGH], row[BID_HIGH])
+    bar[ASK_HIGH] = _high(bar[ASK_HIGH], row[ASK_HIGH])
+    bar[BID_LOW] = _low(bar[BID_LOW], row[BID_LOW])
+    bar[ASK_LOW] = _low(bar[ASK_LOW], row[ASK_LOW])
+    bar[VOLUME] = max(bar[VOLUME], row[VOLUME])
+
+
+class CandleRing:
+    """The last `capacity` bars of one epic and resolution, one
+    preallocated array per COLUMNS entry, oldest bars are overwritten.
+    """
+
+    __slots__ = ('capacity', 'cols', '_start', '_count')
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.cols = [array(column_type(name), [0]) * capacity for name in COLUMNS]
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        pos = (self._start + self._count) % self.capacity
+        for col, value in zip(self.cols, row):
+            col[pos] = value
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def row(self, index):
+        """Bar `index` as a list, oldest first, negative counts from the newest.
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        pos = (self._start + index) % self.capacity
+        return [col[pos] for col in self.cols]
+
+    @property
+    def last_time(self):
+        if not self._count:
+            return None
+        return self.cols[TIME][(self._start + self._count - 1) % self.capacity]
+
+    def columns(self):
+        """Copy of the bars as arrays keyed by COLUMNS, oldest first.
+        """
+        end = self._start + self._count
+        cols = {}
+        for name, col in zip(COLUMNS, self.cols):
+            if end <= self.capacity:
+                cols[name] = col[self._start:end]
+            else:
+                cols[name] = col[self._start:] + col[:end - self.capacity]
+        return cols
+
+
+class _Series:
+
+    __slots__ = ('step', 'ring', 'bar', 'completed')
+
+    def __init__(self, step, capacity):
+        self.step = step
+        self.ring = CandleRing(capacity)
+        self.bar = None
+        self.completed = []
+
+
+class CandleBuilder:
+    """Build OHLC bars of `resolutions` (SECOND to DAY) from stream ticks.
+
+    - Subscribes CHART:<epic>:TICK, or MARKET:<epic> with source='MARKET'
+      where ticks are timed by UPDATE_TIME on today's UTC date
+    - Bars are aligned on UTC multiples of the resolution, volume is the sum
+      of LTV or the tick count without it; ticks older than the live bar
+      are counted in `late` and dropped
+    - Completed bars are kept in a CandleRing per epic and resolution and
+      passed to the bar listeners as arrays keyed by COLUMNS, all bars
+      completed by one stream batch or one ingest() call at once
+    - backfill() puts /prices history (through `cache` when given) in front
+      of the stream bars and completes the first stream bar, joined after
+      its open, from it
+    """
+
+    def __init__(self, stream, epics, resolutions=('MINUTE',), capacity=CAPACITY, web_api=None,
+                 cache=None, source='CHART', loop=None):
+        self._loop = loop
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        for resolution in resolutions:
+            assert resolution in RESOLUTION_SECONDS and resolution not in CALENDAR_RESOLUTIONS, \
+                "resolution error @CandleBuilder"
+        assert source in ('CHART', 'MARKET'), "source error @CandleBuilder"
+        self._stream = stream
+        self._web_api = web_api
+        self._cache = cache
+        self._source = source
+        self._capacity = capacity
+        self._series = dict([(epic, dict([(resolution, _Series(RESOLUTION_SECONDS[resolution], capacity))
+                                          for resolution in resolutions]))
+                             for epic in epics])
+        self._handlers = []
+        self._flushing = False
+        self._sub_id = None
+        self.late = 0
+
+    def add_bar_listener(self, handler):
+        """handler(epic, resolution, cols) for completed bars.
+        """
+        self._handlers.append(handler)
+
+    def start(self):
+        epics = list(self._series)
+        if self._source == 'CHART':
+            conf = {'mode': 'DISTINCT', 'items': ['CHART:%s:TICK' % epic for epic in epics],
+                    'fields': TICK_FIELDS}
+        else:
+            conf = {'mode': 'MERGE', 'items': ['MARKET:%s' % epic for epic in epics],
+                    'fields': MARKET_FIELDS}
+        self._sub_id = self._stream.subscribe(conf, self._on_update)
+
+    def stop(self):
+        if self._sub_id is not None:
+            self._stream.unsubscribe(self._sub_id)
+            self._sub_id = None
+
+    def ring(self, epic, resolution):
+        return self._series[epic][resolution].ring
+
+    def live(self, epic, resolution):
+        """The bar being built as a dict keyed by COLUMNS, None before the
+        first tick.
+        """
+        bar = self._series[epic][resolution].bar
+        if bar is None:
+            return None
+        return dict(zip(COLUMNS, bar))
+
+    def bars(self, epic, resolution, live=True):
+        """Completed bars as arrays keyed by COLUMNS, and the live bar last
+        with live=True.
+        """
+        series = self._series[epic][resolution]
+        cols = series.ring.columns()
+        if live and series.bar is not None:
+            for name, value in zip(COLUMNS, series.bar):
+                cols[name].append(value)
+        return cols
+
+    async def _on_update(self, info):
+        values = info["values"]
+        epic = info["name"].split(':')[1]
+        if self._source == 'CHART':
+            utm = values.get('UTM')
+            ts = int(utm) / 1000.0 if utm else time.time()
+            ask = values.get('OFR')
+            volume = values.get('LTV')
+        else:
+            ts = self._market_time(values.get('UPDATE_TIME'))
+            ask = values.get('OFFER')
+            volume = None
+        self._tick(epic, ts, _number(values.get('BID')), _number(ask),
+                   int(float(volume)) if volume else 1)
+        self._schedule_flush()
+
+    def _market_time(self, update_time):
+        now = time.time()
+        if not update_time:
+            return now
+        ts = now - now % DAY + parse_time(update_time)
+        if ts > now + DAY / 2:
+            ts -= DAY
+        return ts
+
+    def ingest(self, epic, times, bids, asks, volumes=None):
+        """Feed ticks in bulk, sequences of epoch seconds, bid, ask and
+        volume, then call the bar listeners.
+        """
+        if volumes is None:
+            volumes = [1] * len(times)
+        tick = self._tick
+        for ts, bid, ask, volume in zip(times, bids, asks, volumes):
+            tick(epic, ts, bid, ask, volume)
+        self._flush()
+
+    def _tick(self, epic, ts, bid, ask, volume):
+        if math.isnan(bid) and math.isnan(ask):
+            return
+        for series in self._series[epic].values():
+            start = int(ts) - int(ts) % series.step
+            bar = series.bar
+            if bar is None or start > bar[TIME]:
+                if bar is not None:
+                    series.ring.append(bar)
+                    series.completed.append(bar)
+                series.bar = [start, bid, bid, bid, bid, ask, ask, ask, ask, volume]
+                continue
+            if start < bar[TIME]:
+                self.late += 1
+                continue
+            if not math.isnan(bid):
+                if math.isnan(bar[BID_OPEN]):
+                    bar[BID_OPEN] = bid
+                bar[BID_HIGH] = _high(bar[BID_HIGH], bid)
+                bar[BID_LOW] = _low(bar[BID_LOW], bid)
+                bar[BID_CLOSE] = bid
+            if not math.isnan(ask):
+                if math.isnan(bar[ASK_OPEN]):
+                    bar[ASK_OPEN] = ask
+                bar[ASK_HIGH] = _high(bar[ASK_HIGH], ask)
+                bar[ASK_LOW] = _low(bar[ASK_LOW], ask)
+                bar[ASK_CLOSE] = ask
+            bar[VOLUME] += volume
+
+    def _schedule_flush(self):
+        # runs once the listeners of the current stream batch returned
+        if not self._flushing:
+            self._flushing = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flushing = False
+        for epic, by_resolution in self._series.items():
+            for resolution, series in by_resolution.items():
+                if not series.completed:
+                    continue
+                rows, series.completed = series.completed, []
+                if not self._handlers:
+                    continue
+                cols = dict([(name, array(column_type(name), [row[i] for row in rows]))
+                             for i, name in enumerate(COLUMNS)])
+                for handler in self._handlers:
+                    handler(epic, resolution, cols)
+
+    async def _history(self, epic, resolution, start, end):
+        if self._cache is not None:
+            return await self._cache.get(epic, resolution, start, end, columnar=True)
+        cols = dict([(name, array(column_type(name))) for name in COLUMNS])
+        pager = PricePager(self._web_api, epic, resolution, format_utc(start), format_utc(end),
+                           BACKFILL_PAGE, columnar=True)
+        try:
+            async for page in pager:
+                for name in COLUMNS:
+                    cols[name].extend(page[name])
+        finally:
+            await pager.aclose()
+        return cols
+
+    async def backfill(self, epic, resolution, start=None):
+        """Fetch bars from `start` (default: enough to fill the ring) up to
+        the live bar and join them in front of the stream bars.
+        """
+        series = self._series[epic][resolution]
+        step = series.step
+        if len(series.ring):
+            first = series.ring.row(0)[TIME]
+        elif series.bar is not None:
+            first = series.bar[TIME]
+        else:
+            first = int(time.time()) // step * step
+        end = series.bar[TIME] if series.bar is not None else first
+        if start is None:
+            start = first - step * (self._capacity - len(series.ring))
+        history = await self._history(epic, resolution, start, end)
+
+        # the earliest stream bar began after its open, history has all of it
+        rows = [series.ring.row(index) for index in range(len(series.ring))]
+        if rows and rows[0][TIME] == first:
+            joined = rows[0]
+        elif series.bar is not None and series.bar[TIME] == first:
+            joined = series.bar
+        else:
+            joined = None
+        ring = CandleRing(self._capacity)
+        for row in zip(*[history[name] for name in COLUMNS]):
+            if row[TIME] < first:
+                ring.append(row)
+            elif joined is not None and row[TIME] == first:
+                _join(joined, row)
+        for row in rows:
+            ring.append(row)
+        series.ring = ring
+        return len(history['time'])
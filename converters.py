@@ -0,0 +1,126 @@
+import time
+from .prices import PRICE_FIELDS, COLUMNS
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+__all__ = ['prices_array', 'market_details_array', 'sentiments_array', 'parse_times']
+
+
+PRICE_KEYS = [key for _, key in PRICE_FIELDS]
+MARKET_COLUMNS = [
+    ('epic', 'instrument', 'epic'),
+    ('name', 'instrument', 'name'),
+    ('market_status', 'snapshot', 'marketStatus'),
+    ('bid', 'snapshot', 'bid'),
+    ('offer', 'snapshot', 'offer'),
+    ('high', 'snapshot', 'high'),
+    ('low', 'snapshot', 'low'),
+    ('net_change', 'snapshot', 'netChange'),
+    ('percentage_change', 'snapshot', 'percentageChange'),
+    ('delay_time', 'snapshot', 'delayTime'),
+    ('scaling_factor', 'snapshot', 'scalingFactor'),
+]
+MARKET_FLOATS = frozenset(['bid', 'offer', 'high', 'low', 'net_change', 'percentage_change'])
+MARKET_INTS = frozenset(['delay_time', 'scaling_factor'])
+
+
+def _require():
+    assert np is not None, "numpy isn't installed"
+
+
+def parse_times(texts, prefix=''):
+    """Date strings ('2017-06-14T09:30:00', '/' and ' ' separated too, mixed
+    in one list) to int64 epoch seconds, prefix is prepended first
+    ('2017-06-14T' for bare times), None becomes NaT (int64 min).
+    """
+    _require()
+    texts = np.array([text or 'NaT' for text in texts], dtype='U19')
+    if prefix:
+        texts = np.where(texts == 'NaT', texts, np.char.add(prefix, texts))
+    texts = np.char.replace(np.char.replace(texts, '/', '-'), ' ', 'T')
+    return texts.astype('datetime64[s]').astype(np.int64)
+
+
+def _result(cols, names, columnar):
+    if columnar:
+        return cols
+    out = np.empty(len(cols[names[0]]), dtype=[(name, cols[name].dtype) for name in names])
+    for name in names:
+        out[name] = cols[name]
+    return out
+
+
+def prices_array(prices, columnar=False):
+    """Candles of a /prices response (or its `prices`) as a structured
+    array with COLUMNS fields, or a dict of arrays with columnar=True.
+
+    time and volume are int64, prices float64 with nan for missing values.
+    """
+    _require()
+    if isinstance(prices, dict):
+        prices = prices.get('prices', [])
+    flat = []
+    extend = flat.extend
+    for candle in prices:
+        sides = [candle[key] for key in PRICE_KEYS]
+        extend([price.get('bid') for price in sides])
+        extend([price.get('ask') for price in sides])
+    values = np.array(flat, dtype=np.float64).reshape(len(prices), 2 * len(PRICE_KEYS))
+    cols = {
+        'time': parse_times([candle.get('snapshotTimeUTC') or candle['snapshotTime']
+                             for candle in prices]),
+        'volume': np.array([candle.get('lastTradedVolume') or 0 for candle in prices],
+                           dtype=np.int64),
+    }
+    for i, name in enumerate(COLUMNS[1:-1]):
+        cols[name] = np.ascontiguousarray(values[:, i])
+    return _result(cols, COLUMNS, columnar)
+
+
+def market_details_array(info, columnar=False, day=None):
+    """marketDetails of market_detail_chunk/market_detail_mul as a
+    structured array of MARKET_COLUMNS plus update_time, or a dict of
+    arrays with columnar=True.
+
+    update_time is int64 epoch seconds of the snapshot time on `day`
+    ('YYYY-MM-DD', default today UTC).
+    """
+    _require()
+    if isinstance(info, dict):
+        info = info.get('marketDetails', [])
+    rows = [[(detail.get(part) or {}).get(key) for _, part, key in MARKET_COLUMNS] for detail in info]
+    cols = {}
+    for i, (name, _, _) in enumerate(MARKET_COLUMNS):
+        column = [row[i] for row in rows]
+        if name in MARKET_FLOATS:
+            cols[name] = np.array(column, dtype=np.float64)
+        elif name in MARKET_INTS:
+            cols[name] = np.array([v or 0 for v in column], dtype=np.int64)
+        else:
+            cols[name] = np.array([v or '' for v in column], dtype=np.str_)
+    if day is None:
+        day = time.strftime('%Y-%m-%d', time.gmtime())
+    snapshots = [detail.get('snapshot') or {} for detail in info]
+    cols['update_time'] = parse_times(
+        [snapshot.get('updateTimeUTC') or snapshot.get('updateTime') for snapshot in snapshots],
+        day + 'T')
+    return _result(cols, [name for name, _, _ in MARKET_COLUMNS] + ['update_time'], columnar)
+
+
+def sentiments_array(info, columnar=False):
+    """clientSentiments of client_sentiment_mul as a structured array of
+    market_id, long and short percentages, or a dict of arrays with
+    columnar=True.
+    """
+    _require()
+    if isinstance(info, dict):
+        info = info.get('clientSentiments', [])
+    cols = {
+        'market_id': np.array([item.get('marketId') or '' for item in info], dtype=np.str_),
+        'long': np.array([item.get('longPositionPercentage') for item in info], dtype=np.float64),
+        'short': np.array([item.get('shortPositionPercentage') for item in info], dtype=np.float64),
+    }
+    return _result(cols, ['market_id', 'long', 'short'], columnar)
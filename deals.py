@@ -0,0 +1,125 @@
+import time
+import uuid
+import asyncio
+from .log import logger
+from .error import *
+from .instrumentation import Histogram
+
+
+__all__ = ['DealClient', 'new_reference']
+
+
+REFERENCE_APIS = frozenset(['open_positions', 'create_workingorders'])
+DEAL_TIMEOUT = 30
+STREAM_WAIT = 2.0
+POLL_MIN = 0.1
+POLL_MAX = 2.0
+
+
+def new_reference(prefix='QIG'):
+    """Deal reference unique to this client, at most 30 characters.
+    """
+    return (prefix + uuid.uuid4().hex.upper())[:30]
+
+
+class DealClient:
+    """Submit deals and wait for their confirms.
+
+    - open_positions/create_workingorders get a generated deal_reference,
+      other deal APIs are confirmed by the dealReference they return
+    - With an AccountState on a connected stream the confirm is taken from
+      the CONFIRMS update, after `stream_wait` seconds without it (or with
+      no stream) confirm_deal is polled from `poll_min` doubling up to
+      `poll_max` seconds
+    - A submit timing out with a known deal_reference still waits for the
+      confirm, the deal may have gone through
+    - Raise APITimeoutError when no confirm arrives within `timeout`
+    - Submit-to-confirm latency goes to `latency` by source ('stream' or
+      'poll') and to the web_api's Instrumentation
+    """
+
+    def __init__(self, web_api, account_state=None, timeout=DEAL_TIMEOUT, stream_wait=STREAM_WAIT,
+                 poll_min=POLL_MIN, poll_max=POLL_MAX):
+        self._web_api = web_api
+        self._state = account_state
+        self._timeout = timeout
+        self._stream_wait = stream_wait
+        self._poll_min = poll_min
+        self._poll_max = poll_max
+        self.latency = {"stream": Histogram(), "poll": Histogram()}
+
+    def submit(self, api_name, *args, deal_reference=None, **kwargs):
+        """Send the deal, return a future of its confirm.
+        """
+        if api_name in REFERENCE_APIS:
+            if deal_reference is None:
+                deal_reference = new_reference()
+            args = (deal_reference,) + args
+        return asyncio.ensure_future(self._deal(api_name, args, kwargs, deal_reference))
+
+    async def deal(self, api_name, *args, **kwargs):
+        return await self.submit(api_name, *args, **kwargs)
+
+    async def confirm(self, deal_reference):
+        """Confirm of a deal sent elsewhere.
+        """
+        started = time.perf_counter()
+        waiter = self._waiter(deal_reference)
+        try:
+            confirm, _ = await self._wait(deal_reference, waiter, started)
+        finally:
+            if waiter is not None:
+                waiter.cancel()
+        return confirm
+
+    def _waiter(self, deal_reference):
+        if self._state is None or not self._state.streaming:
+            return None
+        return self._state.wait_confirm(deal_reference)
+
+    async def _deal(self, api_name, args, kwargs, deal_reference):
+        started = time.perf_counter()
+        # registered before sending, the confirm can beat the response
+        waiter = None if deal_reference is None else self._waiter(deal_reference)
+        try:
+            try:
+                result = await self._web_api.api(api_name, *args, **kwargs)
+            except APITimeoutError:
+                if deal_reference is None:
+                    raise
+                logger.warning("Deal %s submit timeout, waiting for confirm", deal_reference)
+            else:
+                if deal_reference is None:
+                    deal_reference = result["dealReference"]
+                    waiter = self._waiter(deal_reference)
+            confirm, source = await self._wait(deal_reference, waiter, started)
+        finally:
+            if waiter is not None:
+                waiter.cancel()
+        latency = time.perf_counter() - started
+        self.latency[source].record(latency)
+        if self._web_api.instrument is not None:
+            self._web_api.instrument.deal(api_name, latency, source)
+        return confirm
+
+    async def _wait(self, deal_reference, waiter, started):
+        deadline = started + self._timeout
+        if waiter is not None:
+            await asyncio.wait([waiter], timeout=min(self._stream_wait, self._timeout))
+            if waiter.done():
+                return waiter.result(), "stream"
+        delay = self._poll_min
+        while True:
+            try:
+                return await self._web_api.api('confirm_deal', deal_reference), "poll"
+            except NotFoundError:
+                pass
+            if time.perf_counter() + delay > deadline:
+                raise APITimeoutError("Deal confirm timeout %s" % deal_reference)
+            if waiter is not None:
+                await asyncio.wait([waiter], timeout=delay)
+                if waiter.done():
+                    return waiter.result(), "stream"
+            else:
+                await asyncio.sleep(delay)
+            delay = min(delay * 2, self._poll_max)
@@ -0,0 +1,210 @@
+import time
+from .log import logger
+
+__all__ = ['UpdateDecoder', 'TypedDecoder', 'UpdateRecord', 'FIELD_TYPES']
+
+
+EMPTY_MARK = "$"
+NULL_MARK = "#"
+BAD_VALUE_INTERVAL = 10.0
+
+
+def parse_time(v):
+    """UPDATE_TIME `HH:MM:SS` to seconds of day.
+    """
+    h, m, sec = v.split(':')
+    return int(h) * 3600 + int(m) * 60 + int(sec)
+
+
+FIELD_TYPES = {
+    'str': str,
+    'float': float,
+    'int': int,
+    'time': parse_time,
+}
+
+
+class UpdateDecoder:
+    """Decode Lightstreamer update lines of one subscription.
+
+    - Built once per subscription, field/item tables are fixed
+    - Item state is a preallocated list per item, updated in place
+    """
+
+    __slots__ = ('fields', 'items', 'width', 'updates', '_states')
+
+    def __init__(self, fields, items):
+        self.fields = tuple(fields)
+        self.items = tuple(items)
+        self.width = len(self.fields)
+        self.updates = 0
+        self._states = [[None] * self.width for _ in self.items]
+
+    def reset(self):
+        for state in self._states:
+            state[:] = [None] * self.width
+
+    def state(self, item_pos):
+        return self._states[item_pos-1]
+
+    def update(self, body):
+        """Apply `item|f1|f2...` to the item state, return the item index.
+        """
+        ls = body.split('|')
+        idx = int(ls[0]) - 1
+        self.updates += 1
+        state = self._states[idx]
+        for i, v in enumerate(ls[1:self.width+1]):
+            if not v:
+                continue
+            c = v[0]
+            if c == EMPTY_MARK or c == NULL_MARK:
+                if len(v) > 1:
+                    state[i] = v[1:]
+                elif c == EMPTY_MARK:
+                    state[i] = u''
+                else:
+                    state[i] = None
+            else:
+                state[i] = v
+        return idx
+
+    def decode(self, body):
+        idx = self.update(body)
+        return {
+            "name": self.items[idx],
+            "values": dict(zip(self.fields, self._states[idx]))
+        }
+
+
+class UpdateRecord:
+    """Update of one item, `values` holds converted field values in
+    subscription order, fields are also attributes.
+
+    - rec["name"] / rec["values"] work like the dict updates
+    - Pooled records belong to the stream: IGStreamAPI releases them once
+      the listeners they went to (batch, per update or per table) return,
+      TickQueue when it conflates or drops them. Keep a copy() of records
+      that must outlive the listener call
+    """
+
+    __slots__ = ('name', 'values', '_pool', '_pool_size')
+    fields = ()
+
+    def __init__(self, pool=None, pool_size=0):
+        self.name = None
+        self.values = [None] * len(self.fields)
+        self._pool = pool
+        self._pool_size = pool_size
+
+    def __getitem__(self, key):
+        if key == "name":
+            return self.name
+        if key == "values":
+            return self.as_dict()
+        raise KeyError(key)
+
+    def __repr__(self):
+        return "<%s %s %r>" % (type(self).__name__, self.name, self.as_dict())
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.values))
+
+    def copy(self):
+        rec = type(self)()
+        rec.name = self.name
+        rec.values[:] = self.values
+        return rec
+
+    def release(self):
+        pool = self._pool
+        if pool is not None and len(pool) < self._pool_size:
+            pool.append(self)
+
+
+def _field_property(i):
+    return property(lambda self: self.values[i])
+
+
+def record_class(fields):
+    attrs = dict([(field, _field_property(i)) for i, field in enumerate(fields)])
+    attrs['__slots__'] = ()
+    attrs['fields'] = tuple(fields)
+    return type('UpdateRecord', (UpdateRecord,), attrs)
+
+
+class TypedDecoder(UpdateDecoder):
+    """Decode into UpdateRecord with converted values.
+
+    - types: field to a FIELD_TYPES name or a callable, other fields stay str
+    - Only changed fields are converted, empty and null values are None
+      for non str fields
+    - Values failing conversion are None, counted in `errors` and logged
+      at most once per BAD_VALUE_INTERVAL seconds
+    - pool > 0 keeps up to `pool` released records for reuse
+    """
+
+    __slots__ = ('record', 'errors', '_converters', '_pool', '_pool_size', '_error_logged')
+
+    def __init__(self, fields, items, types, pool=0):
+        super().__init__(fields, items)
+        self.record = record_class(self.fields)
+        converters = []
+        for field in self.fields:
+            conv = types.get(field, str)
+            if not callable(conv):
+                assert conv in FIELD_TYPES, "unknown type %s of %s" % (conv, field)
+                conv = FIELD_TYPES[conv]
+            converters.append(None if conv is str else conv)
+        self._converters = tuple(converters)
+        self._pool = [] if pool > 0 else None
+        self._pool_size = pool
+        self.errors = 0
+        self._error_logged = None
+
+    def _bad_value(self, i, v):
+        self.errors += 1
+        now = time.monotonic()
+        if self._error_logged is None or now - self._error_logged >= BAD_VALUE_INTERVAL:
+            self._error_logged = now
+            logger.warning("bad value %r of %s, %d bad values so far", v, self.fields[i], self.errors)
+
+    def update(self, body):
+        ls = body.split('|')
+        idx = int(ls[0]) - 1
+        self.updates += 1
+        state = self._states[idx]
+        converters = self._converters
+        for i, v in enumerate(ls[1:self.width+1]):
+            if not v:
+                continue
+            c = v[0]
+            if c == EMPTY_MARK or c == NULL_MARK:
+                if len(v) > 1:
+                    v = v[1:]
+                elif c == EMPTY_MARK and converters[i] is None:
+                    state[i] = u''
+                    continue
+                else:
+                    state[i] = None
+                    continue
+            conv = converters[i]
+            if conv is None:
+                state[i] = v
+                continue
+            try:
+                state[i] = conv(v)
+            except ValueError:
+                state[i] = None
+                self._bad_value(i, v)
+        return idx
+
+    def decode(self, body):
+        idx = self.update(body)
+        if self._pool:
+            rec = self._pool.pop()
+        else:
+            rec = self.record(self._pool, self._pool_size)
+        rec.name = self.items[idx]
+        rec.values[:] = self._states[idx]
+        return rec
@@ -0,0 +1,301 @@
+import time
+import string
+import aiohttp
+from .serializer import get_serializer
+
+
+__all__ = ['Endpoint', 'ENDPOINTS']
+
+
+GET = "GET"
+POST = "POST"
+PUT = "PUT"
+DELETE = "DELETE"
+
+RESOLUTIONS = ("SECOND", "MINUTE", "MINUTE_2", "MINUTE_3", "MINUTE_5",
+               "MINUTE_10", "MINUTE_15", "MINUTE_30", "HOUR", "HOUR_2",
+               "HOUR_3", "HOUR_4", "DAY", "WEEK", "MONTH")
+DIRECTIONS = ("BUY", "SELL")
+POSITION_ORDER_TYPES = ("LIMIT", "MARKET")
+POSITION_TIME_IN_FORCES = ("EXECUTE_AND_ELIMINATE", "FILL_OR_KILL")
+WORKING_ORDER_TYPES = ("LIMIT", "STOP")
+WORKING_ORDER_TIME_IN_FORCES = ("GOOD_TILL_CANCELLED", "GOOD_TILL_DATE")
+_MISSING = object()
+
+
+class Endpoint:
+    """Declaration of one REST endpoint.
+
+    - args: argument names in call order, (name, default) for optional ones
+    - path: template formatted with the arguments, trailing '/' is dropped
+      when an argument of the path has a default
+    - params/body: wire name to argument name
+    - joined: arguments sent as ','.join(value)
+    - optional: wire names left out when the value is empty
+    - enums: argument name to allowed values
+
+    compile() turns the declaration into a request coroutine, the url
+    pieces, wire names and headers are resolved once there.
+    """
+
+    __slots__ = ('name', 'method', 'path', 'version', 'args', 'defaults', 'params', 'body',
+                 'joined', 'optional', 'enums')
+
+    def __init__(self, name, method, path, version, args=(), params=None, body=None,
+                 joined=(), optional=(), enums=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.version = str(version)
+        self.args = tuple(arg if isinstance(arg, str) else arg[0] for arg in args)
+        self.defaults = dict([arg for arg in args if not isinstance(arg, str)])
+        self.params = params or {}
+        self.body = body or {}
+        self.joined = frozenset(joined)
+        self.optional = frozenset(optional)
+        self.enums = enums or {}
+
+    def _binder(self):
+        """values(args, kwargs): the call arguments in `args` order, defaults
+        filled in.
+        """
+        names = self.args
+        count = len(names)
+        index = dict([(arg, i) for i, arg in enumerate(names)])
+        defaults = [self.defaults.get(arg, _MISSING) for arg in names]
+        name = self.name
+
+        def values(args, kwargs):
+            if len(args) > count:
+                raise TypeError("%s() takes %d arguments, %d given" % (name, count, len(args)))
+            bound = list(args) + defaults[len(args):]
+            for arg, value in kwargs.items():
+                i = index.get(arg)
+                if i is None:
+                    raise TypeError("%s() got an unexpected argument %r" % (name, arg))
+                if i < len(args):
+                    raise TypeError("%s() got multiple values for %r" % (name, arg))
+                bound[i] = value
+            for i, value in enumerate(bound):
+                if value is _MISSING:
+                    raise TypeError("%s() missing argument %r" % (name, names[i]))
+            return bound
+        return values
+
+    def _url(self, prefix):
+        """url(values) of the path filled with the call arguments.
+        """
+        pieces = []
+        fields = []
+        strip = False
+        for literal, field, _, _ in string.Formatter().parse(self.path):
+            pieces.append(literal.replace('%', '%%'))
+            if field:
+                pieces.append('%s')
+                fields.append(self.args.index(field))
+                strip = strip or field in self.defaults
+        template = prefix + ''.join(pieces)
+        if not fields:
+            path = prefix + self.path
+            return lambda values: path
+        if len(fields) == 1 and not strip:
+            field = fields[0]
+            return lambda values: template % (values[field],)
+        fields = tuple(fields)
+
+        def url(values):
+            text = template % tuple([values[i] for i in fields])
+            return text.rstrip('/') if strip else text
+        return url
+
+    def _mapping(self, mapping):
+        """build(values) of the params/body dict, None without mapping.
+        """
+        if not mapping:
+            return None
+        entries = tuple([(wire, self.args.index(arg), arg in self.joined, wire in self.optional)
+                         for wire, arg in sorted(mapping.items())])
+
+        def build(values):
+            out = {}
+            for wire, i, joined, optional in entries:
+                value = values[i]
+                if optional and not value:
+                    continue
+                out[wire] = ','.join(value) if joined else value
+            return out
+        return build
+
+    def _checker(self):
+        checks = tuple([(self.args.index(arg), frozenset(allowed), "%s error @%s" % (arg, self.name))
+                        for arg, allowed in sorted(self.enums.items())])
+        if not checks:
+            return None
+
+        def check(values):
+            for i, allowed, message in checks:
+                assert values[i] in allowed, message
+        return check
+
+    def compile(self, prefix, request, version_headers, instrument=None, serializer=None):
+        """Build the request coroutine.
+
+        version_headers is looked up on every call, keep updating it in place.
+        With an instrument the coroutine reports instrument.request(), error
+        responses included.
+        Bodies and responses go through serializer, see get_serializer.
+        """
+        if serializer is None:
+            serializer = get_serializer()
+        method = self.method
+        version = self.version
+        count = len(self.args)
+        values = self._binder()
+        check = self._checker()
+        url = self._url(prefix)
+        params = self._mapping(self.params)
+        body = self._mapping(self.body)
+        loads = serializer.loads
+        dumps = serializer.dumps
+
+        def prepare(args, kwargs):
+            bound = args if not kwargs and len(args) == count else values(args, kwargs)
+            if check is not None:
+                check(bound)
+            return (url(bound), None if params is None else params(bound),
+                    None if body is None else dumps(body(bound)))
+
+        if params is None and body is None:
+            async def call(*args, **kwargs):
+                bound = args if not kwargs and len(args) == count else values(args, kwargs)
+                if check is not None:
+                    check(bound)
+                async with request(method, url(bound), headers=version_headers[version],
+                                   params=None, data=None) as resp:
+                    return loads(await resp.read())
+        else:
+            async def call(*args, **kwargs):
+                path, query, data = prepare(args, kwargs)
+                async with request(method, path, headers=version_headers[version], params=query,
+                                   data=data) as resp:
+                    return loads(await resp.read())
+
+        if instrument is None:
+            return call
+
+        name = self.name
+        clock = time.perf_counter
+
+        async def timed_call(*args, **kwargs):
+            path, query, data = prepare(args, kwargs)
+            sent = clock()
+            try:
+                async with request(method, path, headers=version_headers[version], params=query,
+                                   data=data) as resp:
+                    received = clock()
+                    info = loads(await resp.read())
+                    instrument.request(name, resp.status, received - sent, clock() - received)
+                    return info
+            except aiohttp.ClientResponseError as exc:
+                instrument.request(name, exc.status, clock() - sent, 0.0)
+                raise
+        return timed_call
+
+
+ENDPOINTS = [
+    Endpoint('session_detail', GET, "/session", 1),
+    Endpoint('log_out', DELETE, "/session", 1),
+    Endpoint('get_encryption_key', GET, "/session/encryptionKey", 1),
+    Endpoint('refresh_token', POST, "/session/refresh-token", 1, args=['refresh_token'],
+             body={'refresh_token': 'refresh_token'}),
+    Endpoint('accounts', GET, "/accounts", 1),
+    Endpoint('market_navigation', GET, "/marketnavigation/{node_id}", 1, args=[('node_id', '')]),
+    Endpoint('market_detail', GET, "/markets/{epic}", 3, args=['epic']),
+    Endpoint('market_detail_chunk', GET, "/markets", 2, args=['epics', ('filter', 'ALL')],
+             params={'epics': 'epics', 'filter': 'filter'}, joined=['epics']),
+    Endpoint('market_search', GET, "/markets", 1, args=[('searchTerm', '')],
+             params={'searchTerm': 'searchTerm'}),
+    Endpoint('prices', GET, "/prices/{epic}", 3,
+             args=['epic', 'resolution', ('start_date', ''), ('end_date', ''), ('max', 10),
+                   ('page_size', 20), ('page_num', 1)],
+             params={'resolution': 'resolution', 'from': 'start_date', 'to': 'end_date',
+                     'max': 'max', 'pageSize': 'page_size', 'pageNumber': 'page_num'},
+             optional=['from', 'to'], enums={'resolution': RESOLUTIONS}),
+    Endpoint('all_watchlist', GET, "/watchlists", 1),
+    Endpoint('create_watchlist', POST, "/watchlists", 1, args=['name', 'epics'],
+             body={'name': 'name', 'epics': 'epics'}),
+    Endpoint('delete_watchlist', DELETE, "/watchlists/{watchlist_id}", 1, args=['watchlist_id']),
+    Endpoint('watchlist_detail', GET, "/watchlists/{watchlist_id}", 1, args=['watchlist_id']),
+    Endpoint('add_market_to_watchlist', PUT, "/watchlists/{watchlist_id}", 1,
+             args=['watchlist_id', 'epic'], body={'epic': 'epic'}),
+    Endpoint('remove_market_from_watchlist', DELETE, "/watchlists/{watchlist_id}/{epic}", 1,
+             args=['watchlist_id', 'epic']),
+    Endpoint('client_sentiment_mul', GET, "/clientsentiment", 1, args=['marketids'],
+             params={'marketIds': 'marketids'}, joined=['marketids']),
+    Endpoint('client_sentiment', GET, "/clientsentiment/{marketid}", 1, args=['marketid']),
+    Endpoint('related_client_sentiment', GET, "/clientsentiment/related/{marketid}", 1,
+             args=['marketid']),
+    Endpoint('history_activity', GET, "/history/activity", 3,
+             args=[('start_date', ''), ('end_date', ''), ('detailed', False), ('dealid', ''),
+                   ('page_size', 50), ('filter', '')],
+             params={'from': 'start_date', 'to': 'end_date', 'detailed': 'detailed',
+                     'dealId': 'dealid', 'filter': 'filter', 'pageSize': 'page_size'}),
+    Endpoint('confirm_deal', GET, "/confirms/{deal_reference}", 1, args=['deal_reference']),
+    Endpoint('get_positions', GET, "/positions/{dealid}", 2, args=['dealid']),
+    Endpoint('get_all_positions', GET, "/positions", 2),
+    Endpoint('open_positions', POST, "/positions/otc", 2,
+             args=['deal_reference', 'currency', 'direction', 'epic', 'expiry', 'force_open',
+                   'guaranteed_stop', 'level', 'size', 'order_type', 'limit_distance',
+                   'limit_level', 'stop_distance', 'stop_level', 'time_in_force',
+                   'trailing_stop', 'trailing_stop_increment'],
+             body={'currencyCode': 'currency', 'dealReference': 'deal_reference',
+                   'direction': 'direction', 'epic': 'epic', 'expiry': 'expiry',
+                   'forceOpen': 'force_open', 'guaranteedStop': 'guaranteed_stop',
+                   'level': 'level', 'size': 'size', 'orderType': 'order_type',
+                   'limitDistance': 'limit_distance', 'limitLevel': 'limit_level',
+                   'stopDistance': 'stop_distance', 'stopLevel': 'stop_level',
+                   'timeInForce': 'time_in_force', 'trailingStop': 'trailing_stop',
+                   'trailingStopIncrement': 'trailing_stop_increment'},
+             enums={'direction': DIRECTIONS, 'order_type': POSITION_ORDER_TYPES,
+                    'time_in_force': POSITION_TIME_IN_FORCES}),
+    Endpoint('close_positions', DELETE, "/positions/otc", 1,
+             args=['dealid', 'direction', 'epic', 'expiry', 'level', 'size', 'order_type',
+                   'time_in_force'],
+             body={'dealId': 'dealid', 'direction': 'direction', 'epic': 'epic',
+                   'expiry': 'expiry', 'level': 'level', 'size': 'size',
+                   'orderType': 'order_type', 'timeInForce': 'time_in_force'},
+             enums={'direction': DIRECTIONS, 'order_type': POSITION_ORDER_TYPES,
+                    'time_in_force': POSITION_TIME_IN_FORCES}),
+    Endpoint('update_positions', PUT, "/positions/otc/{dealid}", 2,
+             args=['dealid', 'limit_level', 'stop_level', 'trailing_stop',
+                   'trailing_stop_distance', 'trailing_stop_increment'],
+             body={'limitLevel': 'limit_level', 'stopLevel': 'stop_level',
+                   'trailingStop': 'trailing_stop',
+                   'trailingStopDistance': 'trailing_stop_distance',
+                   'trailingStopIncrement': 'trailing_stop_increment'}),
+    Endpoint('get_all_workingorders', GET, "/workingorders", 2),
+    Endpoint('create_workingorders', POST, "/workingorders/otc", 2,
+             args=['deal_reference', 'currency', 'direction', 'epic', 'expiry', 'force_open',
+                   'guaranteed_stop', 'level', 'size', 'order_type', 'limit_distance',
+                   'limit_level', 'stop_distance', 'stop_level', 'time_in_force',
+                   'good_till_date'],
+             body={'currencyCode': 'currency', 'dealReference': 'deal_reference',
+                   'direction': 'direction', 'epic': 'epic', 'expiry': 'expiry',
+                   'forceOpen': 'force_open', 'guaranteedStop': 'guaranteed_stop',
+                   'level': 'level', 'size': 'size', 'type': 'order_type',
+                   'limitDistance': 'limit_distance', 'limitLevel': 'limit_level',
+                   'stopDistance': 'stop_distance', 'stopLevel': 'stop_level',
+                   'timeInForce': 'time_in_force', 'goodTillDate': 'good_till_date'},
+             enums={'direction': DIRECTIONS, 'order_type': WORKING_ORDER_TYPES,
+                    'time_in_force': WORKING_ORDER_TIME_IN_FORCES}),
+    Endpoint('delete_workingorders', DELETE, "/workingorders/otc/{dealid}", 2, args=['dealid']),
+    Endpoint('update_workingorders', PUT, "/workingorders/otc/{dealid}", 2,
+             args=['dealid', 'level', 'order_type', 'limit_distance', 'limit_level',
+                   'stop_distance', 'stop_level', 'time_in_force', 'good_till_date'],
+             body={'level': 'level', 'type': 'order_type', 'limitDistance': 'limit_distance',
+                   'limitLevel': 'limit_level', 'stopDistance': 'stop_distance',
+                   'stopLevel': 'stop_level', 'timeInForce': 'time_in_force',
+                   'goodTillDate': 'good_till_date'},
+             enums={'order_type': WORKING_ORDER_TYPES,
+                    'time_in_force': WORKING_ORDER_TIME_IN_FORCES}),
+]
@@ -1,5 +1,5 @@
 
-__all__ = ['LoginRetryError', 'APITimeoutError', 'UnkownAPIError']
+__all__ = ['LoginRetryError', 'APITimeoutError', 'UnkownAPIError', 'NotFoundError']
 
 class IGError(Exception):
     pass
@@ -12,3 +12,6 @@ class APITimeoutError(IGError):
 
 class UnkownAPIError(IGError):
     pass
+
+class NotFoundError(IGError):
+    pass
@@ -0,0 +1,204 @@
+import math
+import time
+import aiohttp
+
+
+__all__ = ['Instrumentation', 'HistogramCollector', 'Histogram']
+
+
+BUCKETS_PER_OCTAVE = 4
+MIN_VALUE = 1e-6
+DAY = 86400
+
+
+class Instrumentation:
+    """Hooks called by IGWebAPI and IGStreamAPI, all no-ops here.
+
+    - request: one HTTP exchange, `wait` from send to response headers,
+      `decode` for reading and decoding the body
+    - call: one api() call, `queued` in the rate limiter, `relogin` spent
+      re-authenticating, error is the exception raised to the caller
+    - connection: a new connection took `seconds` to open
+    - stream_message: `count` stream lines of `kind`
+    - tick_lag: seconds from a tick's UPDATE_TIME to its handler
+    - deal: seconds from submitting a deal to its confirm, `source` is
+      'stream' or 'poll'
+
+    utc_offset is the offset of the UPDATE_TIME clock from UTC in seconds.
+    """
+
+    def __init__(self, utc_offset=0):
+        self.utc_offset = utc_offset
+
+    def request(self, api_name, status, wait, decode):
+        pass
+
+    def call(self, api_name, total, queued, retries, relogins, relogin, error=None):
+        pass
+
+    def connection(self, seconds):
+        pass
+
+    def stream_message(self, kind, count=1):
+        pass
+
+    def tick_lag(self, item, lag):
+        pass
+
+    def deal(self, api_name, latency, source):
+        pass
+
+    def tick(self, item, update_time, now=None):
+        """Turn UPDATE_TIME (HH:MM:SS or seconds of day) into tick_lag.
+        """
+        if update_time is None or update_time == '':
+            return
+        if isinstance(update_time, str):
+            try:
+                h, m, s = update_time.split(':')
+                update_time = int(h) * 3600 + int(m) * 60 + int(s)
+            except ValueError:
+                return
+        if now is None:
+            now = time.time()
+        lag = (now + self.utc_offset - update_time) % DAY
+        if lag > DAY / 2:
+            lag -= DAY
+        self.tick_lag(item, lag)
+
+    def trace_configs(self):
+        """aiohttp TraceConfig reporting connection(), empty without tracing support.
+        """
+        if not hasattr(aiohttp, 'TraceConfig'):
+            return []
+
+        async def on_create_start(session, ctx, params):
+            ctx.connect_start = time.monotonic()
+
+        async def on_create_end(session, ctx, params):
+            self.connection(time.monotonic() - ctx.connect_start)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        return [trace_config]
+
+
+class Histogram:
+    """Log-bucketed histogram, BUCKETS_PER_OCTAVE buckets per power of two.
+    """
+
+    __slots__ = ('count', 'total', 'max', 'min', '_buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.min = None
+        self._buckets = {}
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value <= MIN_VALUE:
+            index = 0
+        else:
+            index = int(math.ceil(math.log2(value / MIN_VALUE) * BUCKETS_PER_OCTAVE))
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th value, 0 < p <= 1.
+        """
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self.max, MIN_VALUE * 2 ** (index / BUCKETS_PER_OCTAVE))
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class HistogramCollector(Instrumentation):
+    """Collect hook values into histograms and counters.
+
+    - histograms are keyed (name, phase): (api_name, 'wait'/'decode'/
+      'total'/'queued'/'relogin'), ('connection', 'connect'),
+      (api_name, 'confirm') and (item, 'lag'), or ('*', 'lag') with
+      per_item_lag=False
+    - counters are keyed (name, what): (api_name, 'calls'/'retries'/
+      'relogins'/'errors'/status), (api_name, source) of deals and
+      ('stream', kind)
+    """
+
+    def __init__(self, utc_offset=0, per_item_lag=False):
+        super().__init__(utc_offset)
+        self.per_item_lag = per_item_lag
+        self.histograms = {}
+        self.counters = {}
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def _record(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.record(value)
+
+    def _count(self, key, count=1):
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def request(self, api_name, status, wait, decode):
+        self._count((api_name, status))
+        self._record((api_name, 'wait'), wait)
+        self._record((api_name, 'decode'), decode)
+
+    def call(self, api_name, total, queued, retries, relogins, relogin, error=None):
+        self._count((api_name, 'calls'))
+        self._record((api_name, 'total'), total)
+        if queued:
+            self._record((api_name, 'queued'), queued)
+        if retries:
+            self._count((api_name, 'retries'), retries)
+        if relogins:
+            self._count((api_name, 'relogins'), relogins)
+            self._record((api_name, 'relogin'), relogin)
+        if error is not None:
+            self._count((api_name, 'errors'))
+
+    def connection(self, seconds):
+        self._record(('connection', 'connect'), seconds)
+
+    def stream_message(self, kind, count=1):
+        self._count(('stream', kind), count)
+
+    def tick_lag(self, item, lag):
+        self._record((item if self.per_item_lag else '*', 'lag'), lag)
+
+    def deal(self, api_name, latency, source):
+        self._count((api_name, source))
+        self._record((api_name, 'confirm'), latency)
+
+    def snapshot(self):
+        return {
+            "histograms": dict([(key, h.summary()) for key, h in self.histograms.items()]),
+            "counters": dict(self.counters),
+        }
@@ -1,9 +1,125 @@
+import os
+import time
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
+
+__all__ = ['logger', 'set_level', 'RepeatFilter', 'QUEUE_SIZE']
+
+QUEUE_SIZE = 10000
+REPEAT_INTERVAL = 10.0
+REPEAT_KEYS = 1000
+# args kept as they are until the writer thread formats the message
+SCALAR_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class RepeatFilter(logging.Filter):
+    """Let a message of `level` or above, same template and arguments,
+    through once per `interval` seconds.
+
+    The next record let through after suppressed repeats carries
+    `suppressed`, the count of records dropped in between. At most
+    `max_keys` messages are remembered, expired ones are dropped first.
+    """
+
+    def __init__(self, interval=REPEAT_INTERVAL, level=logging.WARNING, max_keys=REPEAT_KEYS):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.max_keys = max_keys
+        self._seen = {}
+
+    def _prune(self, now):
+        self._seen = dict([(key, seen) for key, seen in self._seen.items()
+                           if now - seen[0] < self.interval])
+        if len(self._seen) >= self.max_keys:
+            self._seen = {}
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.levelno, record.msg, record.args)
+        try:
+            hash(key)
+        except TypeError:
+            key = (record.levelno, record.msg, repr(record.args))
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.interval:
+            seen[1] += 1
+            return False
+        record.suppressed = seen[1] if seen is not None else 0
+        if seen is None and len(self._seen) >= self.max_keys:
+            self._prune(now)
+        self._seen[key] = [now, 0]
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread, started by the first record.
+
+    - Messages with scalar args and tracebacks are rendered there, other
+      messages are formatted here, their args may change before
+    - Records are dropped when the queue is full
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        args = record.args
+        if args and not (isinstance(args, tuple) and
+                         all(isinstance(arg, SCALAR_TYPES) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        if not _started:
+            _start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Formatter(logging.Formatter):
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += ' (%d similar suppressed)' % record.suppressed
+        return text
+
+
+def set_level(level):
+    """Level of the library logger, a name like 'INFO' or a logging constant.
+    """
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
 
 logger = logging.getLogger('api')
-fmt = logging.Formatter('%(asctime)s,%(process)d,%(name)s,%(levelname)s,%(filename)s:%(lineno)d,%(message)s')
+fmt = _Formatter('%(asctime)s,%(process)d,%(name)s,%(levelname)s,%(filename)s:%(lineno)d,%(message)s')
 sh = logging.StreamHandler()
 sh.setFormatter(fmt)
 sh.setLevel(logging.DEBUG)
-logger.addHandler(sh)
-logger.setLevel(logging.DEBUG)
+records = queue.Queue(QUEUE_SIZE)
+qh = _QueueHandler(records)
+logger.addHandler(qh)
+logger.addFilter(RepeatFilter())
+set_level(os.environ.get('QIG_LOG_LEVEL', 'DEBUG'))
+listener = logging.handlers.QueueListener(records, sh, respect_handler_level=True)
+_started = False
+_start_lock = threading.Lock()
+
+
+def _start():
+    global _started
+    with _start_lock:
+        if not _started:
+            listener.start()
+            atexit.register(listener.stop)
+            _started = True
@@ -0,0 +1,137 @@
+import math
+import asyncio
+import calendar
+from array import array
+from .log import logger
+
+
+__all__ = ['PricePager', 'candle_columns']
+
+
+PRICE_FIELDS = [
+    ('open', 'openPrice'),
+    ('high', 'highPrice'),
+    ('low', 'lowPrice'),
+    ('close', 'closePrice'),
+]
+COLUMNS = ['time'] + ['%s_%s' % (side, name) for side in ('bid', 'ask') for name, _ in PRICE_FIELDS] + ['volume']
+
+
+def parse_utc(text):
+    """'2017-06-14T09:30:00' (or '/' and ' ' separated) to epoch seconds.
+    """
+    return calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                            int(text[11:13]), int(text[14:16]), int(text[17:19])))
+
+
+def candle_columns(prices):
+    """Convert `prices` of a /prices response to arrays keyed by COLUMNS.
+
+    time and volume are int64 arrays, prices are float64 arrays with nan
+    for missing values.
+    """
+    nan = math.nan
+    cols = dict([(name, array('d')) for name in COLUMNS[1:-1]])
+    cols['time'] = array('q')
+    cols['volume'] = array('q')
+    time_append = cols['time'].append
+    volume_append = cols['volume'].append
+    appends = [(cols['bid_'+name].append, cols['ask_'+name].append, key) for name, key in PRICE_FIELDS]
+    for candle in prices:
+        time_append(parse_utc(candle.get('snapshotTimeUTC') or candle['snapshotTime']))
+        volume_append(candle.get('lastTradedVolume') or 0)
+        for bid_append, ask_append, key in appends:
+            price = candle[key]
+            bid, ask = price.get('bid'), price.get('ask')
+            bid_append(nan if bid is None else bid)
+            ask_append(nan if ask is None else ask)
+    return cols
+
+
+class PricePager:
+    """Async iterator over all pages of /prices for a date range.
+
+    - Yields candles, or one column dict per page with columnar=True
+    - The next page is fetched while the current one is consumed
+    - Stops on metadata.pageData
+    - Leaving early, aclose() (or contextlib.aclosing) cancels the prefetch
+    """
+
+    def __init__(self, web_api, epic, resolution, start_date='', end_date='',
+                 page_size=20, columnar=False, prefetch=True):
+        self._web_api = web_api
+        self._epic = epic
+        self._resolution = resolution
+        self._start_date = start_date
+        self._end_date = end_date
+        self._page_size = page_size
+        self._columnar = columnar
+        self._prefetch = prefetch
+        self._page_num = 0
+        self._total_pages = None
+        self._next = None
+        self._candles = iter(())
+        self.metadata = None
+
+    def _fetch(self, page_num):
+        return asyncio.ensure_future(self._web_api.api(
+            'prices', self._epic, self._resolution, self._start_date, self._end_date,
+            page_size=self._page_size, page_num=page_num))
+
+    def _has_more(self):
+        return self._total_pages is None or self._page_num < self._total_pages
+
+    async def next_page(self):
+        """Return `prices` of the next page, None when finished.
+        """
+        if not self._has_more():
+            return None
+        if self._next is None:
+            self._next = self._fetch(self._page_num+1)
+        info = await self._next
+        self._next = None
+        self._page_num += 1
+
+        self.metadata = info.get('metadata', {})
+        page_data = self.metadata.get('pageData') or {}
+        self._total_pages = page_data.get('totalPages') or self._page_num
+        if self._prefetch and self._has_more():
+            self._next = self._fetch(self._page_num+1)
+        return info.get('prices', [])
+
+    def close(self):
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
+        self._total_pages = self._page_num
+
+    async def aclose(self):
+        """close() and wait for the cancelled prefetch.
+        """
+        task = self._next
+        self.close()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as exc:
+                logger.debug("Prefetch dropped: %r", exc)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._columnar:
+            prices = await self.next_page()
+            if prices is None:
+                raise StopAsyncIteration
+            return candle_columns(prices)
+
+        while True:
+            for candle in self._candles:
+                return candle
+            prices = await self.next_page()
+            if prices is None:
+                raise StopAsyncIteration
+            self._candles = iter(prices)
@@ -0,0 +1,138 @@
+import time
+import heapq
+import asyncio
+
+
+__all__ = ['RateLimiter', 'TokenBucket', 'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW']
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+TRADING_APIS = frozenset([
+    'open_positions', 'close_positions', 'update_positions',
+    'create_workingorders', 'delete_workingorders', 'update_workingorders',
+])
+
+DEFAULT_PRIORITIES = {
+    'open_positions': PRIORITY_HIGH,
+    'close_positions': PRIORITY_HIGH,
+    'update_positions': PRIORITY_HIGH,
+    'create_workingorders': PRIORITY_HIGH,
+    'delete_workingorders': PRIORITY_HIGH,
+    'update_workingorders': PRIORITY_HIGH,
+    'confirm_deal': PRIORITY_HIGH,
+    'market_search': PRIORITY_LOW,
+    'market_navigation': PRIORITY_LOW,
+    'prices': PRIORITY_LOW,
+    'history_activity': PRIORITY_LOW,
+}
+
+
+class TokenBucket:
+    """Token bucket, waiters are served by priority then arrival.
+    """
+
+    def __init__(self, rate, capacity):
+        assert rate > 0 and capacity >= 1, "illegal bucket"
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time.monotonic()
+        self._waiters = []
+        self._seq = 0
+        self._wakeup = None
+        self.count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "waiting": len(self._waiters),
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_avg": self.wait_total / self.count if self.count else 0.0,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _schedule(self):
+        if self._waiters and self._wakeup is None:
+            delay = max(0, (1 - self._tokens) / self.rate)
+            self._wakeup = asyncio.get_event_loop().call_later(delay, self._release)
+
+    def _release(self):
+        self._wakeup = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._tokens -= 1
+            fut.set_result(None)
+        self._schedule()
+
+    def _record(self, wait):
+        self.count += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        """Take one token, return the time spent waiting for it.
+        """
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            self._record(0.0)
+            return 0.0
+
+        start = time.monotonic()
+        fut = asyncio.get_event_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, fut))
+        self._schedule()
+        await fut
+        wait = time.monotonic() - start
+        self._record(wait)
+        return wait
+
+
+class RateLimiter:
+    """Client side limits for IGWebAPI.api.
+
+    - Trading and non-trading endpoints use separate buckets, priorities
+      only order the waiters of one bucket: a trading request never waits
+      on a non-trading one, confirm_deal (non-trading) goes ahead of
+      market_search/prices
+    - Rates are requests per second, defaults follow IG's per-minute limits
+    """
+
+    def __init__(self, trading_rate=100/60, trading_burst=5, non_trading_rate=60/60,
+                 non_trading_burst=5, priorities=None):
+        self.trading = TokenBucket(trading_rate, trading_burst)
+        self.non_trading = TokenBucket(non_trading_rate, non_trading_burst)
+        self._priorities = DEFAULT_PRIORITIES if priorities is None else priorities
+
+    def bucket(self, api_name):
+        return self.trading if api_name in TRADING_APIS else self.non_trading
+
+    def acquire(self, api_name, priority=None):
+        if priority is None:
+            priority = self._priorities.get(api_name, PRIORITY_NORMAL)
+        return self.bucket(api_name).acquire(priority)
+
+    def stats(self):
+        return {
+            "trading": self.trading.stats(),
+            "non_trading": self.non_trading.stats(),
+        }
@@ -0,0 +1,61 @@
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+__all__ = ['Serializer', 'get_serializer', 'BACKENDS']
+
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+class Serializer:
+    """JSON encoding of request bodies and decoding of responses.
+
+    - loads takes the response bytes, an empty body decodes to None
+    - dumps returns utf-8 bytes
+    """
+
+    __slots__ = ('name', '_loads', '_dumps')
+
+    def __init__(self, name):
+        if name == 'orjson':
+            assert orjson is not None, "orjson isn't installed"
+            self._loads = orjson.loads
+            self._dumps = orjson.dumps
+        elif name == 'ujson':
+            assert ujson is not None, "ujson isn't installed"
+            self._loads = ujson.loads
+            self._dumps = lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+        elif name == 'json':
+            self._loads = lambda data: json.loads(data.decode('utf-8'))
+            self._dumps = lambda obj: json.dumps(obj).encode('utf-8')
+        else:
+            raise ValueError("unknown json backend %s" % name)
+        self.name = name
+
+    def loads(self, data):
+        if not data or data.isspace():
+            return None
+        return self._loads(data)
+
+    def dumps(self, obj):
+        return self._dumps(obj)
+
+    def __repr__(self):
+        return "<Serializer %s>" % self.name
+
+
+def get_serializer(name=None):
+    """Serializer of backend `name`, stdlib json by default.
+
+    orjson/ujson only when asked for: orjson rejects non-str dict keys,
+    both round floats and big ints differently from json.
+    """
+    return Serializer(name or 'json')
@@ -0,0 +1,217 @@
+import json
+import math
+import time
+import struct
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+
+__all__ = ['TickPublisher', 'TickReader']
+
+
+MAGIC = b'QIGRING1'
+HEADER = struct.Struct('<8sQQQQ')
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = HEADER.size
+DATA_OFFSET = 64
+RECORD_HEAD = '<QdI4x'
+BUSY = 2**64 - 1
+
+
+def record_struct(kinds):
+    """float fields are 'd', string fields are 'Ns' with N bytes.
+    """
+    return struct.Struct(RECORD_HEAD + ''.join(kinds))
+
+
+def _check():
+    if shared_memory is None:
+        raise RuntimeError("shared memory ring requires python 3.8 or later version")
+
+
+def _attach(name):
+    """Open an existing segment without handing it to this process's
+    resource tracker, the publisher owns and unlinks it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class _Layout:
+
+    def __init__(self, capacity, record_size, n_items, schema_size):
+        self.capacity = capacity
+        self.record_size = record_size
+        self.schema_offset = DATA_OFFSET
+        self.ring_offset = DATA_OFFSET + (schema_size + 7) // 8 * 8
+        self.latest_offset = self.ring_offset + capacity * record_size
+        self.size = self.latest_offset + n_items * record_size
+
+    def slot(self, seq):
+        return self.ring_offset + (seq % self.capacity) * self.record_size
+
+    def latest(self, item_id):
+        return self.latest_offset + item_id * self.record_size
+
+
+class TickPublisher:
+    """Write decoded stream updates into a shared memory ring buffer.
+
+    - Fixed size records: seq, publish time, item id and one value per field
+    - A ring of `capacity` records plus a latest-value slot per item
+    - A record's seq is BUSY while it is written and set last, readers
+      check it before and after copying a record
+    - publish_batch can be passed to IGStreamAPI.add_batch_listener
+    """
+
+    def __init__(self, name, fields, items, kinds=None, capacity=65536):
+        _check()
+        self.fields = list(fields)
+        self.items = list(items)
+        self.kinds = list(kinds) if kinds is not None else ['d'] * len(self.fields)
+        assert len(self.kinds) == len(self.fields), "kinds don't match fields"
+        self._record = record_struct(self.kinds)
+        self._item_ids = dict([(item, i) for i, item in enumerate(self.items)])
+        self._floats = [kind == 'd' for kind in self.kinds]
+        schema = json.dumps({"fields": self.fields, "items": self.items, "kinds": self.kinds}).encode('utf-8')
+        self._layout = _Layout(capacity, self._record.size, len(self.items), len(schema))
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self._layout.size)
+        self._buf = self._shm.buf
+        self._buf[self._layout.schema_offset:self._layout.schema_offset+len(schema)] = schema
+        HEADER.pack_into(self._buf, 0, MAGIC, capacity, self._record.size, len(self.items), len(schema))
+        self._seq = 0
+        SEQ.pack_into(self._buf, SEQ_OFFSET, 0)
+        self.dropped = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def _values(self, values):
+        packed = []
+        for field, is_float in zip(self.fields, self._floats):
+            v = values.get(field)
+            if is_float:
+                try:
+                    packed.append(float(v))
+                except (TypeError, ValueError):
+                    packed.append(math.nan)
+            else:
+                packed.append(v.encode('utf-8') if v else b'')
+        return packed
+
+    def publish(self, info):
+        item_id = self._item_ids.get(info["name"])
+        if item_id is None:
+            self.dropped += 1
+            return
+        seq = self._seq + 1
+        values = self._values(info["values"])
+        buf, layout, record = self._buf, self._layout, self._record
+        ts = time.time()
+
+        for offset in (layout.slot(seq), layout.latest(item_id)):
+            record.pack_into(buf, offset, BUSY, ts, item_id, *values)
+            SEQ.pack_into(buf, offset, seq)
+
+        self._seq = seq
+        SEQ.pack_into(buf, SEQ_OFFSET, seq)
+
+    async def publish_batch(self, infos):
+        for info in infos:
+            self.publish(info)
+
+    def close(self, unlink=True):
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class TickReader:
+    """Read a ring written by TickPublisher, from any process.
+
+    read() returns records (seq, time, item, values) after the last one read,
+    `lost` counts records overwritten before they were read.
+    """
+
+    def __init__(self, name, from_start=False):
+        _check()
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        magic, capacity, record_size, n_items, schema_size = HEADER.unpack_from(self._buf, 0)
+        assert magic == MAGIC, "not a tick ring"
+        self._layout = _Layout(capacity, record_size, n_items, schema_size)
+        offset = self._layout.schema_offset
+        schema = json.loads(bytes(self._buf[offset:offset+schema_size]).decode('utf-8'))
+        self.fields = schema["fields"]
+        self.items = schema["items"]
+        self.kinds = schema["kinds"]
+        self._record = record_struct(self.kinds)
+        self._item_ids = dict([(item, i) for i, item in enumerate(self.items)])
+        self._strings = [i for i, kind in enumerate(self.kinds) if kind != 'd']
+        self._seq = 0 if from_start else self.write_seq
+        self.lost = 0
+
+    @property
+    def write_seq(self):
+        return SEQ.unpack_from(self._buf, SEQ_OFFSET)[0]
+
+    def _decode(self, values):
+        if not self._strings:
+            return values
+        values = list(values)
+        for i in self._strings:
+            values[i] = values[i].rstrip(b'\0').decode('utf-8')
+        return tuple(values)
+
+    def read(self, max_count=None):
+        buf, layout, record = self._buf, self._layout, self._record
+        head = self.write_seq
+        start = self._seq + 1
+        if head - start + 1 > layout.capacity:
+            self.lost += head - start + 1 - layout.capacity
+            start = head - layout.capacity + 1
+        if max_count is not None:
+            head = min(head, start + max_count - 1)
+
+        records = []
+        for seq in range(start, head + 1):
+            offset = layout.slot(seq)
+            row = record.unpack_from(buf, offset)
+            if row[0] != seq or SEQ.unpack_from(buf, offset)[0] != seq:
+                self.lost += 1
+                continue
+            records.append((seq, row[1], self.items[row[2]], self._decode(row[3:])))
+        self._seq = max(self._seq, head)
+        return records
+
+    def latest(self, item):
+        """Last (seq, time, values) of item, None if never published.
+        """
+        buf, record = self._buf, self._record
+        offset = self._layout.latest(self._item_ids[item])
+        while True:
+            row = record.unpack_from(buf, offset)
+            if row[0] == 0:
+                return None
+            if row[0] != BUSY and SEQ.unpack_from(buf, offset)[0] == row[0]:
+                return row[0], row[1], self._decode(row[3:])
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
@@ -1,8 +1,14 @@
+import time
 import aiohttp
 import asyncio
+import inspect
+from urllib.parse import urlencode
 from .log import logger
 from .error import *
 from .api import IGWebAPI
+from .decoder import UpdateDecoder, TypedDecoder
+from .tick_queue import TickQueue
+from .transport import Transport
 
 
 __all__ = ['IGStreamAPI']
@@ -12,6 +18,7 @@ CONNECT_PATH = "/lightstreamer/create_session.txt"
 BIND_PATH = "/lightstreamer/bind_session.txt"
 CONTROL_PATH = "/lightstreamer/control.txt"
 OP_ADD = "add"
+OP_DELETE = "delete"
 OK_MSG = "OK"
 ERR_MSG = "ERROR"
 PROBE_MSG = "PROBE"
@@ -19,13 +26,49 @@ LOOP_MSG = "LOOP"
 SYNC_ERR_MSG = "SYNC ERROR"
 END_MSG = "END"
 PREAMBLE_MSG = "Preamble"
+MERGE_MODE = "MERGE"
+CONTROL_BATCH = 20
+CONSUME_BATCH = 500
+END_DELAY = 15
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+UPDATE_TIME_FIELD = "UPDATE_TIME"
+
+
+def as_coroutine(func):
+    """Coroutine function calling func, awaiting what it returns if needed.
+    """
+    if asyncio.iscoroutinefunction(func):
+        return func
+
+    async def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    return wrapper
 
 
 class IGStreamAPI:
     """Implement stream API of IG.
+
+    - queue_size > 0 decouples handlers from the reader through a TickQueue
+      drained by `consumers` tasks, MERGE updates of one item are conflated,
+      a consumer takes at most CONSUME_BATCH updates at a time
+    - Web and stream requests share one Transport, pass one in to share it
+      with other instances
+    - After reconnect all tables are re-added in batched control requests
+      sent concurrently, item states are kept, see `recovery` for timings
+    - A table conf with 'types' (field to type, see decoder.FIELD_TYPES)
+      produces UpdateRecord updates, 'pool': N recycles them once the
+      listeners return
+    - Pass an Instrumentation to count stream messages by kind and the lag
+      of UPDATE_TIME behind the handler call
+    - After an END the new session is created `end_delay` seconds later
     """
 
-    def __init__(self, api_prefix, app_key, account, password, adapter_set, loop=None, **kwargs):
+    def __init__(self, api_prefix, app_key, account, password, adapter_set, loop=None,
+                 queue_size=0, consumers=1, transport=None, web_api=None, instrument=None,
+                 end_delay=END_DELAY, **kwargs):
         self._loop = loop
         if self._loop is None:
             self._loop = asyncio.get_event_loop()
@@ -34,19 +77,46 @@ class IGStreamAPI:
         self._account = account
         self._password = password
         self._adapter_set = adapter_set
+        self._end_delay = end_delay
         self._stream_endpoint = None
         self._account_id = None
         self._CST = None
         self._XST = None
-        self.web_api = IGWebAPI(api_prefix, app_key, account, password, read_timeout=10, conn_timeout=5)
-        self._session = aiohttp.ClientSession(read_timeout=0, conn_timeout=10)
+        self._own_transport = transport is None
+        if transport is None:
+            transport = Transport(loop=self._loop)
+        self._transport = transport
+        self._own_web_api = web_api is None
+        if web_api is None:
+            web_api = IGWebAPI(api_prefix, app_key, account, password, transport=transport,
+                               instrument=instrument, read_timeout=10, conn_timeout=5)
+        self.web_api = web_api
+        self._session = transport.session(read_timeout=0, conn_timeout=10)
         self._stream = None
         self._meta_data = {}
         self._control_endpoint = None
         self._subscribe_map = {}
+        self._last_sub_id = 0
+        self._pooled = 0
+        self._routed = []
+        self._reconnect_handler = None
+        self._pending = b''
+        self._handler = None
+        self._batch_handler = None
+        self._queue = TickQueue(queue_size) if queue_size > 0 else None
+        self._consumers = consumers
+        self._instrument = instrument
+        self._recovery = {"rebinds": 0, "reconnects": 0, "last": None, "max": 0.0, "total": 0.0}
 
-    def __del__(self):
-        self._session.close()
+    async def close(self):
+        """Close the stream session, and the web API and Transport made here.
+        """
+        self._close_stream()
+        await self._session.close()
+        if self._own_web_api:
+            await self.web_api.close()
+        if self._own_transport:
+            await self._transport.close()
 
     async def _refresh_credential(self):
         info = await self.web_api.api('session_detail')
@@ -80,6 +150,22 @@ class IGStreamAPI:
         lines = data.split('\r\n')
         return lines
 
+    async def _readbatch(self):
+        try:
+            data = await self._stream.content.readany()
+        except Exception as exc:
+            exc_info = (type(exc), exc, exc.__traceback__)
+            logger.error("Read Error: ", exc_info=exc_info)
+            exc.__traceback__ = None
+            return None
+        if not data:
+            return None
+
+        head, sep, self._pending = (self._pending + data).rpartition(b'\r\n')
+        if not sep:
+            return []
+        return head.decode('utf-8').split('\r\n')
+
     async def _handle_stream(self):
         line = await self._readline()
         if line == OK_MSG:
@@ -99,7 +185,7 @@ class IGStreamAPI:
         else:
             lines = await self._readlines()
             lines.insert(0, line)
-            logger.error('\n'.join(lines))
+            logger.error("Stream Error:\n%s", '\n'.join(lines))
             return False
 
     async def _stream_connet(self):
@@ -143,128 +229,293 @@ class IGStreamAPI:
         ret = await self._handle_stream()
         return ret
 
-    async def _subscribe(self):
-        for sub_id in self._subscribe_map:
-            dct = {
-                "LS_session": self._meta_data["SessionId"],
-                "LS_Table": sub_id,
-                "LS_op": OP_ADD,
-                "LS_mode": self._subscribe_map[sub_id]['conf']['mode'],
-                "LS_schema": " ".join(self._subscribe_map[sub_id]['conf']['fields']),
-                "LS_id": " ".join(self._subscribe_map[sub_id]['conf']['items'])
-            }
-            retry = 3
-            while True:
-                retry -= 1
-                try:
-                    async with self._session.post(self._control_endpoint + CONTROL_PATH, data=dct) as resp:
-                        info = await resp.text()
-                        if not info.startswith(OK_MSG):
-                            logger.error("Subscribe Error")
-                            logger.error(info)
-                            logger.error(dct)
-                except aiohttp.ServerTimeoutError as exc:
-                    if not retry:
-                        raise APITimeoutError('Connect timeout when subscribe')
-                else:
-                    break
+    async def _control(self, requests):
+        """Send control requests batched in one POST, one line per request.
+        """
+        data = "\r\n".join(urlencode(dct) for dct in requests)
+        retry = 3
+        while True:
+            retry -= 1
+            try:
+                async with self._session.post(self._control_endpoint + CONTROL_PATH, data=data,
+                                              headers=FORM_HEADERS) as resp:
+                    info = await resp.text()
+                    if ERR_MSG in info or not info.startswith(OK_MSG):
+                        logger.error("Control Error: %s %r", info, requests)
+            except aiohttp.ServerTimeoutError as exc:
+                if not retry:
+                    raise APITimeoutError('Connect timeout when control')
+            else:
+                break
 
-    def _reset_context(self):
-        self._session.close()
-        self._stream = None
-        self._session = aiohttp.ClientSession(read_timeout=0, conn_timeout=10)
-        for sub_id in self._subscribe_map:
-            self._subscribe_map[sub_id]['items'] = {}
+    def _add_request(self, sub_id):
+        return {
+            "LS_session": self._meta_data["SessionId"],
+            "LS_Table": sub_id,
+            "LS_op": OP_ADD,
+            "LS_mode": self._subscribe_map[sub_id]['conf']['mode'],
+            "LS_schema": " ".join(self._subscribe_map[sub_id]['conf']['fields']),
+            "LS_id": " ".join(self._subscribe_map[sub_id]['conf']['items'])
+        }
+
+    def _delete_request(self, sub_id):
+        return {
+            "LS_session": self._meta_data["SessionId"],
+            "LS_Table": sub_id,
+            "LS_op": OP_DELETE,
+        }
+
+    async def _subscribe(self, started=None):
+        requests = [self._add_request(sub_id) for sub_id in self._subscribe_map]
+        await asyncio.gather(*[self._control(requests[i:i+CONTROL_BATCH])
+                               for i in range(0, len(requests), CONTROL_BATCH)])
+        if started is not None:
+            self._record_recovery("reconnects", started)
+
+    def _record_recovery(self, kind, started):
+        cost = time.monotonic() - started
+        self._recovery[kind] += 1
+        self._recovery["last"] = cost
+        self._recovery["total"] += cost
+        if cost > self._recovery["max"]:
+            self._recovery["max"] = cost
+        logger.info("%s recovered in %.3fs", kind, cost)
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._pending = b''
+
+    def _reset_context(self, keep_items=True):
+        self._close_stream()
+        if not keep_items:
+            for sub_id in self._subscribe_map:
+                self._subscribe_map[sub_id]['decoder'].reset()
         self._meta_data = {}
         self._control_endpoint = None
 
-    def _data_decode(self, c_v, l_v):
-        if c_v == "$":
-            return u''
-        elif c_v == "#":
+    def _data_parse(self, msg):
+        sub_id, _, body = msg.partition(',')
+        sub = self._subscribe_map.get(int(sub_id))
+        if sub is None:
+            return None
+        info = sub['decoder'].decode(body)
+        if sub['listener'] is not None:
+            self._routed.append((sub['listener'], info))
             return None
-        elif not c_v:
-            return l_v
-        elif c_v[0] in "#$":
-            c_v = c_v[1:]
-        return c_v
+        return info
 
-    def _data_parse(self, msg):
-        ls = msg.split(',', 1)
-        sub_id, item = int(ls[0]), ls[1]
-        ls = item.split("|")
-        item_pos = int(ls[0])
-        field_dct = dict(list(zip(self._subscribe_map[sub_id]['conf']['fields'], ls[1:])))
-
-        last_item = self._subscribe_map[sub_id]['items'].get(item_pos, {})
-        self._subscribe_map[sub_id]['items'][item_pos] = dict([
-            (k, self._data_decode(v, last_item.get(k))) for k, v in field_dct.items()
-        ])
-
-        item_info = {
-            "name": self._subscribe_map[sub_id]['conf']['items'][item_pos-1],
-            "values": self._subscribe_map[sub_id]['items'][item_pos]
-        }
-        return item_info
+    def _data_enqueue(self, msg):
+        sub_id, _, body = msg.partition(',')
+        sub_id = int(sub_id)
+        sub = self._subscribe_map.get(sub_id)
+        if sub is None:
+            return
+        info = sub['decoder'].decode(body)
+        if sub['listener'] is not None:
+            self._routed.append((sub['listener'], info))
+        elif sub['conf']['mode'] == MERGE_MODE:
+            self._queue.put(info, (sub_id, info['name']))
+        else:
+            self._queue.put(info)
+
+    async def _consume(self):
+        while True:
+            infos = await self._queue.get(CONSUME_BATCH)
+            try:
+                await self._dispatch(infos)
+            except Exception as exc:
+                exc_info = (type(exc), exc, exc.__traceback__)
+                logger.error("Handler Error: ", exc_info=exc_info)
+                exc.__traceback__ = None
+
+    def _count_messages(self, lines):
+        counts = {}
+        for line in lines:
+            if not line:
+                continue
+            if line == PROBE_MSG:
+                kind = "probe"
+            elif line.startswith(ERR_MSG):
+                kind = "error"
+            elif line.startswith(SYNC_ERR_MSG):
+                kind = "sync_error"
+            elif line.startswith(LOOP_MSG):
+                kind = "loop"
+            elif line.startswith(END_MSG):
+                kind = "end"
+            elif line.startswith(PREAMBLE_MSG):
+                kind = "preamble"
+            else:
+                kind = "update"
+            counts[kind] = counts.get(kind, 0) + 1
+            if kind == "loop" or kind == "end":
+                break
+        for kind, count in counts.items():
+            self._instrument.stream_message(kind, count)
+
+    def _tick_lags(self, infos):
+        instrument = self._instrument
+        now = time.time()
+        for info in infos:
+            if type(info) is dict:
+                update_time = info["values"].get(UPDATE_TIME_FIELD)
+            else:
+                update_time = getattr(info, UPDATE_TIME_FIELD, None)
+            instrument.tick(info["name"], update_time, now)
+
+    async def _dispatch_routed(self):
+        routed, self._routed = self._routed, []
+        for listener, info in routed:
+            await listener(info)
+            if self._pooled and type(info) is not dict:
+                info.release()
+
+    async def _dispatch(self, infos):
+        if self._instrument is not None:
+            self._tick_lags(infos)
+        if self._batch_handler is not None:
+            await self._batch_handler(infos)
+        if self._handler is not None:
+            for info in infos:
+                await self._handler(info)
+        if self._pooled:
+            for info in infos:
+                if type(info) is not dict:
+                    info.release()
 
     def add_listener(self, handler):
-        self._handler = asyncio.coroutines.coroutine(handler)
+        self._handler = as_coroutine(handler)
+
+    def add_batch_listener(self, handler):
+        """handler receives the list of item updates decoded from one read.
+        """
+        self._batch_handler = as_coroutine(handler)
+
+    @property
+    def queue(self):
+        return self._queue
 
-    def subscribe(self, conf):
-        sub_id = len(self._subscribe_map)+1
-        self._subscribe_map[sub_id] = {'conf': conf, 'items': {}}
+    @property
+    def recovery(self):
+        """Counts and seconds spent from LOOP/END to rebound or re-subscribed.
+        """
+        return self._recovery
+
+    def add_reconnect_listener(self, handler):
+        """handler(stream) is called on reconnect, before the new session is created.
+        """
+        self._reconnect_handler = handler
+
+    @property
+    def connected(self):
+        return self._control_endpoint is not None
+
+    def subscriptions(self):
+        return dict([(sub_id, sub['conf']) for sub_id, sub in self._subscribe_map.items()])
+
+    def subscription_updates(self, sub_id):
+        return self._subscribe_map[sub_id]['decoder'].updates
+
+    def subscribe(self, conf, listener=None):
+        """Add a table, sent at once when connected, return its id.
+
+        With a listener, updates of this table go to listener(info) only,
+        bypassing the queue and the stream listeners.
+        """
+        self._last_sub_id += 1
+        sub_id = self._last_sub_id
+        if conf.get('types') is not None:
+            decoder = TypedDecoder(conf['fields'], conf['items'], conf['types'], conf.get('pool', 0))
+        else:
+            decoder = UpdateDecoder(conf['fields'], conf['items'])
+        if listener is not None:
+            listener = as_coroutine(listener)
+        self._subscribe_map[sub_id] = {'conf': conf, 'decoder': decoder, 'listener': listener}
+        if conf.get('pool'):
+            self._pooled += 1
+        if self.connected:
+            self._loop.create_task(self._control([self._add_request(sub_id)]))
+        return sub_id
+
+    def unsubscribe(self, sub_id):
+        sub = self._subscribe_map.pop(sub_id)
+        if sub['conf'].get('pool'):
+            self._pooled -= 1
+        if self.connected:
+            self._loop.create_task(self._control([self._delete_request(sub_id)]))
 
     async def start(self):
-        try:
-            handler = getattr(self, "_handler")
-        except AttributeError:
+        if self._handler is None and self._batch_handler is None and \
+                not any(sub['listener'] for sub in self._subscribe_map.values()):
             raise RuntimeError("Can't find listener")
         await self._refresh_credential()
         await self._stream_connet()
         self._loop.create_task(self._subscribe())
+        consumers = []
+        if self._queue is not None:
+            consumers = [self._loop.create_task(self._consume()) for _ in range(self._consumers)]
 
-        while True:
-            rebind = False
-            reconnect = False
+        try:
             while True:
-                line = await self._readline()
+                rebind = False
+                reconnect = False
+                while not (rebind or reconnect):
+                    lines = await self._readbatch()
+                    if lines is None:
+                        raise RuntimeError("read data error")
 
-                if line is None:
-                    raise RuntimeError("read data error")
-                elif line == PROBE_MSG:
-                    pass
-                elif line.startswith(ERR_MSG):
-                    logger.error("ERR receive")
-                    logger.error(line)
-                    raise RuntimeError("stream receive ERR_MSG")
-                elif line.startswith(SYNC_ERR_MSG):
-                    logger.error("SYNC_ERR receive")
-                    logger.error(line)
-                    raise RuntimeError("stream receive SYNC_ERR_MSG")
-                elif line.startswith(LOOP_MSG):
-                    logger.info("LOOP receive")
-                    logger.info(line)
-                    rebind = True
-                    break
-                elif line.startswith(END_MSG):
-                    logger.error("END receive")
-                    logger.error(line)
-                    asyncio.sleep(15)
-                    reconnect = True
-                    break
-                elif line.startswith(PREAMBLE_MSG):
-                    pass
-                else:
-                    info = self._data_parse(line)
-                    await self._handler(info)
-
-            if rebind:
-                self._stream = None
-                ret = await self._rebind()
-                if not ret:
-                    reconnect = True
-            if reconnect:
-                logger.debug("reconnect")
-                self._reset_context()
-                await self._stream_connet()
-                self._loop.create_task(self._subscribe())
+                    if self._instrument is not None:
+                        self._count_messages(lines)
+                    infos = []
+                    for line in lines:
+                        if not line or line == PROBE_MSG:
+                            pass
+                        elif line.startswith(ERR_MSG):
+                            logger.error("ERR receive: %s", line)
+                            raise RuntimeError("stream receive ERR_MSG")
+                        elif line.startswith(SYNC_ERR_MSG):
+                            logger.error("SYNC_ERR receive: %s", line)
+                            raise RuntimeError("stream receive SYNC_ERR_MSG")
+                        elif line.startswith(LOOP_MSG):
+                            logger.info("LOOP receive: %s", line)
+                            rebind = True
+                            break
+                        elif line.startswith(END_MSG):
+                            logger.error("END receive: %s", line)
+                            await asyncio.sleep(self._end_delay)
+                            reconnect = True
+                            break
+                        elif line.startswith(PREAMBLE_MSG):
+                            pass
+                        elif self._queue is not None:
+                            self._data_enqueue(line)
+                        else:
+                            info = self._data_parse(line)
+                            if info is not None:
+                                infos.append(info)
+                    if infos:
+                        await self._dispatch(infos)
+                    if self._routed:
+                        await self._dispatch_routed()
+
+                started = time.monotonic()
+                if rebind:
+                    self._close_stream()
+                    ret = await self._rebind()
+                    if ret:
+                        self._record_recovery("rebinds", started)
+                    else:
+                        reconnect = True
+                if reconnect:
+                    logger.debug("reconnect")
+                    self._reset_context()
+                    if self._reconnect_handler is not None:
+                        self._reconnect_handler(self)
+                    await self._refresh_credential()
+                    await self._stream_connet()
+                    self._loop.create_task(self._subscribe(started))
+        finally:
+            for task in consumers:
+                task.cancel()
@@ -0,0 +1,188 @@
+import time
+import asyncio
+from .api import IGWebAPI
+from .stream_api import IGStreamAPI, as_coroutine
+from .transport import Transport
+
+
+__all__ = ['StreamManager']
+
+
+SPLIT_ITEMS = 100
+RATE_WEIGHT = 1.0
+TOLERANCE = 0.2
+
+
+class StreamManager:
+    """Shard subscriptions over several IGStreamAPI sessions.
+
+    - Tables with more than `split_items` items are split into parts
+    - Parts go to the shard with the lowest load, load of a part is its
+      item count plus RATE_WEIGHT per observed update/s
+    - A reconnecting shard is rebalanced against the others before its
+      tables are re-added
+    - All shards feed one set of listeners
+    - All shards share one IGWebAPI (one login) and one Transport
+    """
+
+    def __init__(self, api_prefix, app_key, account, password, adapter_set, shards=2,
+                 loop=None, transport=None, split_items=SPLIT_ITEMS, **kwargs):
+        self._loop = loop
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._own_transport = transport is None
+        if transport is None:
+            transport = Transport(loop=self._loop)
+        self._transport = transport
+        self._split_items = split_items
+        self.web_api = IGWebAPI(api_prefix, app_key, account, password, transport=transport,
+                                instrument=kwargs.get('instrument'), read_timeout=10, conn_timeout=5)
+        self._shards = []
+        self._stats = []
+        for index in range(shards):
+            shard = IGStreamAPI(api_prefix, app_key, account, password, adapter_set,
+                                loop=self._loop, transport=transport, web_api=self.web_api, **kwargs)
+            self._stats.append({"messages": 0, "batches": 0, "started": None})
+            shard.add_batch_listener(self._forwarder(index))
+            shard.add_reconnect_listener(self.rebalance)
+            self._shards.append(shard)
+        self._tables = {}
+        self._last_table_id = 0
+        self._handler = None
+        self._batch_handler = None
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def add_listener(self, handler):
+        self._handler = as_coroutine(handler)
+
+    def add_batch_listener(self, handler):
+        self._batch_handler = as_coroutine(handler)
+
+    def _forwarder(self, index):
+        stats = self._stats[index]
+
+        async def forward(infos):
+            stats["messages"] += len(infos)
+            stats["batches"] += 1
+            if self._batch_handler is not None:
+                await self._batch_handler(infos)
+            if self._handler is not None:
+                for info in infos:
+                    await self._handler(info)
+        return forward
+
+    def _elapsed(self, index):
+        started = self._stats[index]["started"]
+        if started is None:
+            return None
+        return max(time.monotonic() - started, 1.0)
+
+    def _part_load(self, part):
+        index, sub_id, conf = part
+        load = len(conf['items'])
+        elapsed = self._elapsed(index)
+        if elapsed is not None:
+            load += RATE_WEIGHT * self._shards[index].subscription_updates(sub_id) / elapsed
+        return load
+
+    def _parts(self, index):
+        return [part for parts in self._tables.values() for part in parts if part[0] == index]
+
+    def loads(self):
+        loads = [0.0] * len(self._shards)
+        for parts in self._tables.values():
+            for part in parts:
+                loads[part[0]] += self._part_load(part)
+        return loads
+
+    def subscribe(self, conf):
+        """Subscribe a table, return the id used by unsubscribe.
+        """
+        items = conf['items']
+        parts = []
+        loads = self.loads()
+        for i in range(0, len(items), self._split_items):
+            part_conf = dict(conf, items=items[i:i+self._split_items])
+            index = loads.index(min(loads))
+            parts.append([index, self._shards[index].subscribe(part_conf), part_conf])
+            loads[index] += len(part_conf['items'])
+        self._last_table_id += 1
+        self._tables[self._last_table_id] = parts
+        return self._last_table_id
+
+    def unsubscribe(self, table_id):
+        for index, sub_id, _ in self._tables.pop(table_id):
+            self._shards[index].unsubscribe(sub_id)
+
+    def _move(self, part, dst):
+        self._shards[part[0]].unsubscribe(part[1])
+        part[0] = dst
+        part[1] = self._shards[dst].subscribe(part[2])
+
+    def rebalance(self, shard):
+        """Move parts between `shard` and the others until loads are within TOLERANCE.
+        """
+        index = self._shards.index(shard)
+        loads = self.loads()
+        target = sum(loads) / len(loads)
+        others = [i for i in range(len(self._shards)) if i != index and self._shards[i].connected]
+        if not others:
+            return
+
+        parts = sorted(self._parts(index), key=self._part_load)
+        while len(parts) > 1 and loads[index] > target * (1 + TOLERANCE):
+            part = parts.pop(0)
+            load = self._part_load(part)
+            dst = min(others, key=lambda i: loads[i])
+            if loads[dst] + load > target * (1 + TOLERANCE):
+                break
+            self._move(part, dst)
+            loads[index] -= load
+            loads[dst] += load
+
+        while loads[index] < target * (1 - TOLERANCE):
+            src = max(others, key=lambda i: loads[i])
+            candidates = [part for part in self._parts(src)
+                          if loads[index] + self._part_load(part) <= target * (1 + TOLERANCE)]
+            if not candidates:
+                break
+            part = min(candidates, key=self._part_load)
+            load = self._part_load(part)
+            self._move(part, index)
+            loads[index] += load
+            loads[src] -= load
+
+    def stats(self):
+        loads = self.loads()
+        stats = []
+        for index, shard in enumerate(self._shards):
+            parts = self._parts(index)
+            elapsed = self._elapsed(index)
+            messages = self._stats[index]["messages"]
+            stats.append({
+                "connected": shard.connected,
+                "tables": len(parts),
+                "items": sum(len(conf['items']) for _, _, conf in parts),
+                "load": loads[index],
+                "messages": messages,
+                "batches": self._stats[index]["batches"],
+                "rate": messages / elapsed if elapsed else 0.0,
+                "recovery": shard.recovery,
+            })
+        return stats
+
+    async def _start_shard(self, index):
+        self._stats[index]["started"] = time.monotonic()
+        await self._shards[index].start()
+
+    async def start(self):
+        await asyncio.gather(*[self._start_shard(index) for index in range(len(self._shards))])
+
+    async def close(self):
+        await asyncio.gather(*[shard.close() for shard in self._shards])
+        await self.web_api.close()
+        if self._own_transport:
+            await self._transport.close()
@@ -0,0 +1,95 @@
+import asyncio
+from collections import deque
+
+
+__all__ = ['TickQueue']
+
+
+def _release(info):
+    if type(info) is not dict:
+        release = getattr(info, 'release', None)
+        if release is not None:
+            release()
+
+
+class TickQueue:
+    """Bounded queue between stream reader and handlers.
+
+    - Updates put with a key replace the pending update of the same key
+    - When full, the oldest pending update is dropped
+    - Replaced and dropped updates are release()d when they have it, see
+      decoder.UpdateRecord
+    """
+
+    def __init__(self, maxsize=10000):
+        assert maxsize > 0, "maxsize must be positive"
+        self._maxsize = maxsize
+        self._entries = deque()
+        self._keyed = {}
+        self._event = asyncio.Event()
+        self.put_count = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        return len(self._entries)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def stats(self):
+        return {
+            "depth": len(self._entries),
+            "max_depth": self.max_depth,
+            "put": self.put_count,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+        }
+
+    def put(self, info, key=None):
+        self.put_count += 1
+        if key is not None:
+            entry = self._keyed.get(key)
+            if entry is not None:
+                _release(entry[1])
+                entry[1] = info
+                self.conflated += 1
+                return
+        if len(self._entries) >= self._maxsize:
+            old_key, old = self._entries.popleft()
+            if old_key is not None:
+                del self._keyed[old_key]
+            _release(old)
+            self.dropped += 1
+        entry = [key, info]
+        self._entries.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        if len(self._entries) > self.max_depth:
+            self.max_depth = len(self._entries)
+        self._event.set()
+
+    def get_nowait(self, max_count=None):
+        """Pop up to max_count pending updates, oldest first.
+        """
+        entries = self._entries
+        count = len(entries)
+        if max_count is not None and max_count < count:
+            count = max_count
+        infos = []
+        for _ in range(count):
+            key, info = entries.popleft()
+            if key is not None:
+                del self._keyed[key]
+            infos.append(info)
+        if not entries:
+            self._event.clear()
+        return infos
+
+    async def get(self, max_count=None):
+        while not self._entries:
+            await self._event.wait()
+        return self.get_nowait(max_count)
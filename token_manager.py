@@ -0,0 +1,88 @@
+import time
+import asyncio
+from .log import logger
+
+
+__all__ = ['TokenManager']
+
+
+TOKEN_TTL = 6 * 3600
+TOKEN_MARGIN = 300
+RETRY_DELAY = 30
+
+
+class TokenManager:
+    """Keep the CST/X-SECURITY-TOKEN pair of IGWebAPI fresh.
+
+    - Only one re-authentication runs at a time, callers share it
+    - Callers pass the generation their request was sent with, a 401 from an
+      already replaced token just waits for / reuses the new one
+    - Tokens are renewed `margin` seconds before `ttl`, on the next request
+      or from the background task started by start()
+    """
+
+    def __init__(self, login, ttl=TOKEN_TTL, margin=TOKEN_MARGIN):
+        self._login = login
+        self._ttl = ttl
+        self._margin = margin
+        self._pending = None
+        self._task = None
+        self.generation = 0
+        self.issued_at = None
+        self.logins = 0
+
+    @property
+    def expires_at(self):
+        if self.issued_at is None:
+            return None
+        return self.issued_at + self._ttl
+
+    def due(self):
+        return self.issued_at is not None and \
+            time.monotonic() >= self.issued_at + self._ttl - self._margin
+
+    async def renew(self, generation=None):
+        """Re-authenticate unless the token is newer than `generation`.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._renew())
+        await asyncio.shield(self._pending)
+
+    async def _renew(self):
+        try:
+            await self._login()
+            self.generation += 1
+            self.issued_at = time.monotonic()
+            self.logins += 1
+        finally:
+            self._pending = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            if self.issued_at is None:
+                delay = RETRY_DELAY
+            else:
+                delay = max(0, self.issued_at + self._ttl - self._margin - time.monotonic())
+            await asyncio.sleep(delay)
+            if self.issued_at is None or not self.due():
+                continue
+            try:
+                await self.renew(self.generation)
+            except Exception as exc:
+                logger.error("Token renew fail: %r", exc)
+                await asyncio.sleep(RETRY_DELAY)
@@ -0,0 +1,41 @@
+import ssl
+import aiohttp
+
+
+__all__ = ['Transport']
+
+
+class Transport:
+    """Connection pool shared by IGWebAPI and IGStreamAPI.
+
+    - One keep-alive connector with per-host limits and DNS cache
+    - One SSLContext for all connections, CA certificates are loaded once.
+      TLS sessions aren't resumed, a new connection does a full handshake,
+      the keep-alive pool is what saves handshakes
+    - Sessions made by `session()` don't own the connector, closing them
+      keeps warm connections in the pool
+    """
+
+    def __init__(self, limit=100, limit_per_host=20, keepalive_timeout=60,
+                 ttl_dns_cache=300, ssl_context=None, loop=None):
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        self._ssl_context = ssl_context
+        self._connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host,
+                                               keepalive_timeout=keepalive_timeout,
+                                               use_dns_cache=True, ttl_dns_cache=ttl_dns_cache,
+                                               ssl=ssl_context, loop=loop)
+
+    @property
+    def connector(self):
+        return self._connector
+
+    @property
+    def closed(self):
+        return self._connector.closed
+
+    def session(self, **kwargs):
+        return aiohttp.ClientSession(connector=self._connector, connector_owner=False, **kwargs)
+
+    async def close(self):
+        await self._connector.close()